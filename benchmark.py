@@ -0,0 +1,212 @@
+import os
+import sys
+import json
+import subprocess
+import time
+import resource
+import argparse
+import tracemalloc
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import utilities as U
+import solver
+from magic_square import MagicSquare, METHODS, get_evenness, get_method
+
+# Each benchmark maps n to the function to time, doing any setup up front.
+def setup_construct(method, n):
+    return MagicSquare(n, method=method).construct
+
+def setup_construct_tiles(n):
+    # The usual method, in row tiles on one thread per core
+    return partial(MagicSquare(n).construct, workers=None)
+
+def setup_solver(n):
+    # In this process, so that the timing is of the search alone
+    return lambda: sum(len(squares) for squares in solver.enumerate_squares(n, workers=0))
+
+def setup_verify(verify, n):
+    magic_s = MagicSquare(n).construct()
+    return partial(verify, magic_s)
+
+# The construct benchmarks are named after the method they use
+CONSTRUCT_PREFIX = "construct:"
+
+BENCHMARKS = {
+    "verify_magic_square": partial(setup_verify, partial(U.verify_magic_square, print_message=False)),
+    "check_magic_square": partial(setup_verify, U.check_magic_square),
+    "enumerate_squares": setup_solver,
+    "construct_tiles": setup_construct_tiles,
+}
+# One for every registered method, and one for whichever "auto" picks
+for method in ["auto"] + list(METHODS):
+    BENCHMARKS[CONSTRUCT_PREFIX + method] = partial(setup_construct, method)
+
+# Which sizes each benchmark runs on: constructors only make sense for their
+# own evenness, and the step by step walks get too slow for big n.
+def accepts(name, n):
+    # Only small squares can be enumerated
+    if name == "enumerate_squares":
+        return n <= 4
+    method = name[len(CONSTRUCT_PREFIX):]
+    if name.startswith(CONSTRUCT_PREFIX) and method != "auto":
+        return METHODS[method].accepts(n) and not (METHODS[method].pen_and_paper and n > 1000)
+    return True
+
+def get_ns(sizes):
+    # Each size gives one n of each evenness class: 4m, 4m+1 and 4m+2
+    ns = set()
+    for size in sizes:
+        base = max(4, size - size % 4)
+        ns.update([base, base + 1, base + 2])
+    return sorted(ns)
+
+def measure(name, n, repeat=3):
+    '''
+    Time one benchmark at one n: the best and mean wall time over repeat
+    runs, then one more run under tracemalloc for the peak traced
+    allocation. Peak RSS is that of the whole process, so run this in a
+    fresh process (see run_benchmarks) to get per case numbers.
+    '''
+    run = BENCHMARKS[name](n)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    alloc_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = {"benchmark": name, "n": n,
+              "evenness": get_evenness(n).name,
+              "seconds": min(times), "mean_seconds": sum(times)/len(times),
+              "alloc_peak_bytes": alloc_peak,
+              # ru_maxrss is in kilobytes on Linux
+              "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024}
+    if name.startswith(CONSTRUCT_PREFIX):
+        # What the method expected to cost, next to what it did
+        method = get_method(n, name[len(CONSTRUCT_PREFIX):])
+        result.update({"method": method.name, "estimated_seconds": method.estimate_seconds(n),
+                       "estimated_bytes": method.estimate_bytes(n)})
+    return result
+
+def run_benchmarks(names, ns, repeat=3, isolate=True):
+    '''
+    Run every benchmark in names at every n in ns it applies to. With
+    isolate, each case gets a fresh process so that its peak RSS is its own.
+    '''
+    cases = [(name, n) for name in names for n in ns if accepts(name, n)]
+    if not isolate:
+        return [measure(name, n, repeat) for name, n in cases]
+    results = []
+    for name, n in cases:
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            results.append(executor.submit(measure, name, n, repeat).result())
+    return results
+
+def compare(results, baseline, tolerance=0.25):
+    '''
+    Regressions against a baseline (a list of results saved earlier): the
+    cases whose best time or peak traced allocation grew by more than
+    tolerance (as a fraction) over the baseline.
+    '''
+    baseline = {(result["benchmark"], result["n"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline.get((result["benchmark"], result["n"]))
+        if old is None:
+            continue
+        for metric in ["seconds", "alloc_peak_bytes"]:
+            if old[metric] and result[metric] > (1 + tolerance)*old[metric]:
+                regressions.append({"benchmark": result["benchmark"], "n": result["n"],
+                                    "metric": metric, "baseline": old[metric],
+                                    "now": result[metric],
+                                    "ratio": result[metric]/old[metric]})
+    return regressions
+
+# The modules of the library API, whose import should be fast and side effect free
+CORE_MODULES = ["instrumentation", "utilities", "magic_square", "odd", "singly_even", "doubly_even",
+                "lazy_magic_square", "square_cache", "tracing", "serialization", "composition"]
+
+IMPORT_SCRIPT = '''
+import sys, time, numpy as np
+options = np.get_printoptions()
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print()
+print(seconds, np.get_printoptions() != options, "curses" in sys.modules)
+'''
+
+def measure_import(module, repeat=5):
+    '''
+    Time importing module in a fresh interpreter (numpy is imported first,
+    as everything needs it anyway), and note any side effects of the
+    import: printing, changing numpy's print options or loading curses.
+    '''
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT.format(module=module)],
+                                capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        printed, last_line = output.rsplit("\n", 2)[:2]
+        seconds, changes_printoptions, loads_curses = last_line.split()
+        times.append(float(seconds))
+    side_effects = [effect for effect, happened in [("prints", printed != ""),
+                                                     ("changes print options", changes_printoptions == "True"),
+                                                     ("loads curses", loads_curses == "True")]
+                    if happened]
+    return {"benchmark": "import " + module, "n": 0, "evenness": None,
+            "seconds": min(times), "mean_seconds": sum(times)/len(times),
+            "alloc_peak_bytes": 0, "peak_rss_bytes": 0, "side_effects": side_effects}
+
+def print_results(results):
+    print("{:>38} {:>7} {:>11} {:>13} {:>13} {:>11} {:>13}".format(
+        "benchmark", "n", "seconds", "alloc peak", "peak RSS", "estimated", "est. peak"))
+    for result in results:
+        name = result["benchmark"]
+        if name == CONSTRUCT_PREFIX + "auto":
+            name += " ({})".format(result["method"])
+        estimates = ""
+        if "estimated_seconds" in result:
+            estimates = " {:>11.5f} {:>11.1f}MB".format(result["estimated_seconds"],
+                                                          result["estimated_bytes"]/2**20)
+        print("{:>38} {:>7d} {:>11.5f} {:>11.1f}MB {:>11.1f}MB{}".format(
+            name, result["n"], result["seconds"],
+            result["alloc_peak_bytes"]/2**20, result["peak_rss_bytes"]/2**20, estimates))
+        if result.get("side_effects"):
+            print("{:>38} side effects: {}".format("", ", ".join(result["side_effects"])))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark construction and verification.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 4000],
+                        help="each size s gives one n of each evenness class around s")
+    parser.add_argument("--benchmarks", nargs="+", default=list(BENCHMARKS),
+                        choices=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--imports", action="store_true",
+                        help="also time importing each module of the library")
+    parser.add_argument("--no-isolate", action="store_true",
+                        help="run every case in this process (peak RSS is then cumulative)")
+    parser.add_argument("--output", help="write the results here as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.benchmarks, get_ns(args.sizes), repeat=args.repeat,
+                             isolate=not args.no_isolate)
+    if args.imports:
+        results += [measure_import(module) for module in CORE_MODULES]
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), tolerance=args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: {benchmark} at n = {n}: {metric} went from {baseline:.6g} to {now:.6g} ({ratio:.2f}x)".format(**regression))
+        if regressions:
+            sys.exit(1)
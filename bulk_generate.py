@@ -0,0 +1,98 @@
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from magic_square import MagicSquare
+
+def get_square_path(out_dir, n):
+    return os.path.join(out_dir, "magic_square_{:d}.npy".format(n))
+
+def build_one(n, out_dir, dtype=None, verify=True):
+    '''
+    Construct the n x n square straight into its .npy file in out_dir (and
+    stream it back to verify it, if asked). Runs inside a worker process,
+    so only these few numbers travel back, never the square itself.
+    '''
+    ms = MagicSquare(n)
+    path = get_square_path(out_dir, n)
+    start = time.perf_counter()
+    ms.construct_to_file(path, dtype=dtype)
+    constructed = time.perf_counter()
+    magic = bool(ms.verify_file(path, print_message=False)) if verify else None
+    verified = time.perf_counter()
+    return {"n": n, "evenness": ms.evenness.name, "path": path, "magic": magic,
+            "construct_seconds": constructed - start,
+            "verify_seconds": verified - constructed}
+
+def summarize(results, wall_seconds):
+    '''
+    Throughput per size class (Odd, SinglyEven, DoublyEven): how many
+    squares and cells were built and how many cells per second each phase
+    managed, counting the time spent inside the workers.
+    '''
+    throughput = {}
+    for result in results:
+        size_class = throughput.setdefault(result["evenness"], {
+            "squares": 0, "cells": 0, "construct_seconds": 0.0, "verify_seconds": 0.0})
+        size_class["squares"] += 1
+        size_class["cells"] += result["n"]**2
+        size_class["construct_seconds"] += result["construct_seconds"]
+        size_class["verify_seconds"] += result["verify_seconds"]
+    for size_class in throughput.values():
+        for phase in ["construct", "verify"]:
+            seconds = size_class[phase + "_seconds"]
+            size_class[phase + "_cells_per_second"] = size_class["cells"]/seconds if seconds else None
+    return {"wall_seconds": wall_seconds, "throughput": throughput}
+
+def generate_range(ns, out_dir="magic_squares", workers=None, verify=True,
+                   dtype=None):
+    '''
+    Construct (and verify) a magic square for every n in ns, spread over a
+    pool of worker processes. By default each square gets the smallest
+    unsigned dtype that holds its numbers. Each square is written to
+    out_dir/magic_square_<n>.npy by its worker, so results come back
+    through the output directory instead of being pickled.
+
+    Returns (results, report): one dict per n, sorted by n, and the
+    throughput report from summarize.
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Biggest squares first, so that no worker is left with a huge one at the end
+        futures = [executor.submit(build_one, n, out_dir, dtype, verify)
+                   for n in sorted(set(ns), reverse=True)]
+        for future in as_completed(futures):
+            results.append(future.result())
+    results.sort(key=lambda result: result["n"])
+    return results, summarize(results, time.perf_counter() - start)
+
+def print_report(results, report):
+    failed = [result["n"] for result in results if result["magic"] is False]
+    print("Built {:d} squares in {:.2f}s".format(len(results), report["wall_seconds"]))
+    for name, size_class in sorted(report["throughput"].items()):
+        print("{:>10}: {:6d} squares, {:14d} cells, construct {:.3g} cells/s, verify {}".format(
+            name, size_class["squares"], size_class["cells"],
+            size_class["construct_cells_per_second"] or 0,
+            "{:.3g} cells/s".format(size_class["verify_cells_per_second"])
+            if size_class["verify_cells_per_second"] else "skipped"))
+    if failed:
+        print("NOT magic: {}".format(failed))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Construct and verify magic squares for every n in [low, high].")
+    parser.add_argument("low", type=int)
+    parser.add_argument("high", type=int)
+    parser.add_argument("--out-dir", default="magic_squares")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dtype", default=None,
+                        help="numpy dtype of the saved squares (default: smallest that fits)")
+    parser.add_argument("--no-verify", action="store_true")
+    args = parser.parse_args()
+    # There is no 2 x 2 magic square
+    ns = [n for n in range(args.low, args.high + 1) if n != 2]
+    results, report = generate_range(ns, out_dir=args.out_dir, workers=args.workers,
+                                     verify=not args.no_verify, dtype=args.dtype)
+    print_report(results, report)
@@ -0,0 +1,161 @@
+import sys
+import time
+import argparse
+import numpy as np
+import utilities as U
+from odd import construct_odd_magic_square
+from singly_even import construct_singly_even_magic_square
+from doubly_even import construct_doubly_even_magic_square
+from lazy_magic_square import LazyMagicSquare
+from magic_square import MagicSquare, Evenness, METHODS, DEFAULT_METHODS, get_evenness
+
+# Checks that every way of building squares gives magic squares, that the
+# ones meant to give the same square do, cell for cell, and that the time
+# they take grows no faster than about n*n. Exits with status 1
+# if anything fails, so it can gate a build:
+#
+#     python check_constructors.py --max-n 150 --scaling-sizes 500 1000 2000 4000
+
+# The standalone functions, as (closed form, pen and paper) builders of the
+# same square as the usual method of their evenness
+STANDALONE = {
+    Evenness.Odd: (construct_odd_magic_square,
+                   lambda n: construct_odd_magic_square(n, pen_and_paper=True)),
+    Evenness.SinglyEven: (lambda n: construct_singly_even_magic_square(n, print_LUX=False),
+                          lambda n: construct_singly_even_magic_square(n, print_LUX=False,
+                                                                       on_step=lambda i, j, value: None)),
+    Evenness.DoublyEven: (construct_doubly_even_magic_square,
+                          lambda n: construct_doubly_even_magic_square(n, on_step=lambda i, j, value: None)),
+}
+
+def check_square(failures, label, magic_s, n):
+    # A permutation of 1..n*n with every line adding up
+    result = U.check_magic_square(magic_s, stop_early=True, check_permutation=True)
+    if magic_s.shape != (n, n) or not result:
+        failures.append("{}: not a magic square of order {:d} ({})".format(label, n, result.failure))
+        return False
+    return True
+
+def check_same(failures, label, magic_s, expected):
+    if magic_s.shape != expected.shape or not np.array_equal(magic_s, expected):
+        failures.append("{}: differs from the square it should match in {:d} cells".format(
+            label, np.count_nonzero(magic_s != expected) if magic_s.shape == expected.shape else -1))
+
+def check_n(n, max_walk_n=200):
+    '''
+    The failures (as strings) of every check at one n: each registered
+    method, the standalone functions, the class's own methods and walks,
+    tiles, bands and the lazy square, against the usual square for n.
+    '''
+    failures = []
+    evenness = get_evenness(n)
+    expected = MagicSquare(n).construct()
+    if not check_square(failures, "MagicSquare({:d})".format(n), expected, n):
+        return failures
+    usual = METHODS[DEFAULT_METHODS[evenness]]
+
+    for name, method in METHODS.items():
+        if not method.accepts(n) or (method.pen_and_paper and n > max_walk_n):
+            continue
+        label = "{} at n = {:d}".format(name, n)
+        ms = MagicSquare(n, method=name)
+        magic_s = ms.construct()
+        if not check_square(failures, label, magic_s, n):
+            continue
+        # The same square whichever way it is filled
+        if method.fill_rows is not None:
+            bands = np.empty_like(magic_s)
+            for row_start in range(0, n, 7):
+                method.fill_rows(n, bands[row_start:row_start+7], row_start)
+            check_same(failures, label + " in bands", bands, magic_s)
+            if not method.pen_and_paper:
+                check_same(failures, label + " in tiles", ms.construct(workers=3), magic_s)
+        if method.fill_rows is usual.fill_rows:
+            check_same(failures, label, magic_s, expected)
+
+    closed_form, pen_and_paper = STANDALONE[evenness]
+    check_same(failures, "{} at n = {:d}".format(closed_form.__name__, n), closed_form(n), expected)
+    if n <= max_walk_n:
+        check_same(failures, "standalone pen and paper at n = {:d}".format(n), pen_and_paper(n), expected)
+        # The events of a trace fill in the same square too
+        traced = np.zeros_like(expected)
+        for i, j, value, _, _ in MagicSquare(n).trace():
+            traced[i, j] = value
+        check_same(failures, "trace at n = {:d}".format(n), traced, expected)
+
+    lazy = LazyMagicSquare(n)
+    check_same(failures, "LazyMagicSquare at n = {:d}".format(n), lazy[0:n, 0:n], expected)
+    return failures
+
+def get_n(size, evenness):
+    # The n of the evenness class closest above the multiple of 4 below size
+    base = max(4, size - size % 4)
+    return {Evenness.DoublyEven: base, Evenness.Odd: base + 1, Evenness.SinglyEven: base + 2}[evenness]
+
+def time_construct(n, method, repeat=3):
+    # Best time of building the square with method, into a reused array
+    ms = MagicSquare(n, method=method)
+    out = np.empty((n, n), dtype=ms.dtype)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ms.construct(out=out)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def check_scaling(sizes, max_exponent=2.5, walk_sizes=(50, 100, 200), repeat=3):
+    '''
+    Time every method at each size (one n of its evenness class per size)
+    and fail any whose time grows faster than n**max_exponent. Building an
+    n x n square is O(n*n), so the exponent, fitted over all the sizes at
+    once, should be about 2: one slow step, e.g. as the square outgrows a
+    cache, moves the fit much less than it moves the ratio of two times.
+    Returns (timings, failures), timings holding (method, n, seconds).
+    '''
+    timings, failures = [], []
+    for name, method in METHODS.items():
+        method_sizes = walk_sizes if method.pen_and_paper else sizes
+        points = []
+        for size in method_sizes:
+            n = next((get_n(size, evenness) for evenness in method.evenness
+                      if method.accepts(get_n(size, evenness))), None)
+            if n is None:
+                continue
+            seconds = time_construct(n, name, repeat)
+            timings.append((name, n, seconds))
+            points.append((n, seconds))
+        if len(points) < 2:
+            continue
+        # The slope of log(seconds) against log(n)
+        exponent = np.polyfit(*np.log(np.array(points)).T, 1)[0]
+        if exponent > max_exponent:
+            failures.append("{}: time grows like n**{:.2f} from n = {:d} to {:d}, faster than n**{:.1f}".format(
+                name, exponent, points[0][0], points[-1][0], max_exponent))
+    return timings, failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that every constructor gives the right squares in good time.")
+    parser.add_argument("--max-n", type=int, default=150, help="check every n from 1 to this")
+    parser.add_argument("--extra-n", type=int, nargs="*", default=[255, 256, 257, 1001, 1002, 1004],
+                        help="and these")
+    parser.add_argument("--scaling-sizes", type=int, nargs="*", default=[500, 1000, 2000, 4000],
+                        help="sizes to time the methods at (none to skip)")
+    parser.add_argument("--max-exponent", type=float, default=2.5,
+                        help="fastest a method's time may grow, as a power of n")
+    args = parser.parse_args()
+
+    failures = []
+    ns = [n for n in range(1, args.max_n + 1) if n != 2] + args.extra_n
+    for n in ns:
+        failures += check_n(n)
+    print("Checked {:d} sizes: {:d} failures".format(len(ns), len(failures)))
+
+    if args.scaling_sizes:
+        timings, scaling_failures = check_scaling(args.scaling_sizes, max_exponent=args.max_exponent)
+        for name, n, seconds in timings:
+            print("{:>20} {:>7d} {:>11.5f}".format(name, n, seconds))
+        failures += scaling_failures
+
+    for failure in failures:
+        print("FAILED:", failure)
+    sys.exit(1 if failures else 0)
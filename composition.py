@@ -0,0 +1,68 @@
+import sys
+import numpy as np
+import utilities as U
+import square_cache
+
+def product_square(A, B, out=None, dtype=None):
+    '''
+    The product of the magic squares A (order p) and B (order q), a magic
+    square of order p*q: block (i, j) of it is B plus (A[i, j]-1)*q*q, so
+
+        M[i*q + r, j*q + s] = (A[i, j]-1)*q*q + B[r, s]
+
+    Every line of M adds up as a line of A, scaled, plus p lines of B. It
+    is filled with one broadcast add over (i, r, j, s), like a Kronecker
+    product, straight into out.
+    '''
+    p, q = A.shape[0], B.shape[0]
+    n = p*q
+    magic_s = U.get_output(n, out, dtype)
+    blocks = (A.astype(magic_s.dtype) - 1)*(q*q)
+    np.add(blocks[:, None, :, None], B.astype(magic_s.dtype)[None, :, None, :],
+           out=magic_s.reshape(p, q, p, q))
+    return magic_s
+
+def get_factor_squares(n, dtype=None):
+    # The squares of orders p and q to make the n x n square from, from the cache
+    factors = U.get_factor_pair(n)
+    assert factors is not None, "{:d} isn't a product of two orders of at least 3".format(n)
+    return [square_cache.get_square(factor, dtype=dtype) for factor in factors]
+
+def fill_product_rows(n, out, row_start=0):
+    '''
+    Fill out (shape (rows, n)) with rows row_start, ... of the product of
+    the usual squares of the factors of n (see U.get_factor_pair). Row
+    i*q + r only needs row i of A and row r of B, so the temporaries are
+    rows x (p+q), however big n is.
+    '''
+    A, B = get_factor_squares(n)
+    p, q = A.shape[0], B.shape[0]
+    i, r = np.divmod(np.arange(row_start, row_start + out.shape[0]), q)
+    blocks = (A[i].astype(out.dtype) - 1)*(q*q)
+    np.add(blocks[:, :, None], B[r].astype(out.dtype)[:, None, :],
+           out=out.reshape(out.shape[0], p, q))
+    return out
+
+def construct_product(ms, out=None):
+    # The "product" method of magic_square.py: the product square for the MagicSquare ms
+    magic_s = U.get_output(ms.n, out, ms.dtype)
+    return product_square(*get_factor_squares(ms.n), out=magic_s)
+
+def iter_product_squares(As, Bs, dtype=None):
+    '''
+    The product of every square in As with every square in Bs, all of
+    order p*q: from a small library of squares, e.g. solver.all_squares(4)
+    or the variants of symmetries.py, this gives a great many distinct
+    big ones (different pairs always give different products).
+    '''
+    for A in As:
+        for B in Bs:
+            yield product_square(A, B, dtype=dtype)
+
+if __name__ == "__main__":
+    from magic_square import MagicSquare
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    ms = MagicSquare(n, method="product")
+    p, q = U.get_factor_pair(n)
+    print("The {:d} x {:d} square as the product of the {:d} x {:d} and {:d} x {:d} ones".format(n, n, p, p, q, q))
+    ms.verify(print_square=n <= 30)
@@ -1,4 +1,8 @@
+import sys
+import time
 import curses
+import traceback
+import numpy as np
 import utilities as U
 
 def curses_init():              # Create a window and initialize curses
@@ -21,6 +25,22 @@ def curses_close(stdscr):       # Exit curses gracefully
 def pause_for(delay=500):       # for readability
     curses.napms(delay)
 
+# Color pairs, set up once by init_colors
+LATEST_CELL, FILLED_CELL, STATUS = 1, 2, 3
+
+def init_colors():
+    if curses.has_colors():
+        curses.init_pair(LATEST_CELL, curses.COLOR_BLACK, curses.COLOR_YELLOW)
+        curses.init_pair(FILLED_CELL, curses.COLOR_GREEN, curses.COLOR_BLACK)
+        curses.init_pair(STATUS, curses.COLOR_RED, curses.COLOR_BLACK)
+
+def get_attribute(pair):
+    return curses.color_pair(pair) if curses.has_colors() else curses.A_NORMAL
+
+# (row, column) steps of the keys scrolling the visible part of the square
+SCROLL_KEYS = {curses.KEY_UP: (-1, 0), curses.KEY_DOWN: (1, 0),
+               curses.KEY_LEFT: (0, -1), curses.KEY_RIGHT: (0, 1)}
+
 def get_column(j, display_size):
     # The initial 2 is for numpy's double [[ start to a matrix
     # The +1 is for the gap between two column entries
@@ -28,23 +48,207 @@ def get_column(j, display_size):
     # j is the number of numbers
     return 2+(display_size+1)*j
 
-def print_cell(w, m, i, j, delay=500, base_yx=None):
+class CursesVisualizer:
     '''
-    When the [i, j] entry of matrix m gets updated, reprint just that.
+    Shows a square being filled in, cell by cell. Pass it as the on_step
+    callback of any constructor (it is called with i, j and the value
+    written there) and call finish once the square is done.
+
+    Steps are paced at speed steps per second, but the screen is only
+    redrawn fps times a second, and then only the cells changed since the
+    last frame (with noutrefresh/doupdate, so nothing flickers). Only the
+    part of the square that fits on the screen is drawn; it follows the
+    latest cell unless scrolled by hand.
+
+    Keys: + and - double or halve the speed, space pauses, s skips to the
+    end, the arrow keys scroll and f goes back to following.
     '''
-    n = m.shape[0]
-    display_size = U.get_display_size(n)
-    base_y, base_x = base_yx if base_yx is not None else (0, 0)
-    x, y = base_x + get_column(j, display_size), base_y + i
+    HELP = "+/- speed  space pause  s skip  arrows scroll  f follow"
 
-    pause_for(delay)
-    curses.init_pair(1, curses.COLOR_BLACK, curses.COLOR_YELLOW)
-    curses.init_pair(2, curses.COLOR_RED, curses.COLOR_BLACK)
-    curses.init_pair(3, curses.COLOR_GREEN, curses.COLOR_BLACK)
+    def __init__(self, w, n, base_yx=(0, 0), speed=2.0, fps=30):
+        self.w = w
+        self.n = n
+        self.base_y, self.base_x = base_yx
+        self.speed = speed
+        self.frame_seconds = 1/fps
+        self.display_size = U.get_display_size(n)
+        self.format_cell = U.get_np_int_formatter(n)
+        self.values = np.full((n, n), U.EMPTY_CELL, dtype=U.get_smallest_dtype(n))
+        self.steps = 0
+        self.latest = None
+        self.paused, self.skipping, self.following = False, False, True
+        self.top, self.left = 0, 0
+        self.changed = set()
+        self.needs_redraw = True
+        self.step_time = self.frame_time = time.monotonic()
+        init_colors()
+        w.nodelay(True)         # getch returns -1 at once when no key was pressed
+        self._draw_frame()
 
-    display_format_string = U.get_display_format_string(n)
-    if curses.has_colors():
-        w.addstr(y, x, display_format_string.format(m[i, j]), curses.color_pair(3))
-    else:
-        w.addstr(y, x, display_format_string.format(m[i, j]))
-    w.refresh()
+    def _get_viewport_size(self):
+        height, width = self.w.getmaxyx()
+        # The last line of the screen is for the status
+        rows = max(1, min(self.n, height - 1 - self.base_y))
+        cols = max(1, min(self.n, (width - self.base_x - 3)//(self.display_size + 1)))
+        return rows, cols
+
+    def _scroll_to(self, top, left):
+        rows, cols = self._get_viewport_size()
+        top, left = min(max(0, top), self.n - rows), min(max(0, left), self.n - cols)
+        if (top, left) != (self.top, self.left):
+            self.top, self.left = top, left
+            self.needs_redraw = True
+
+    def _follow(self):
+        # Center the latest cell if it went out of view
+        rows, cols = self._get_viewport_size()
+        i, j = self.latest
+        if not (self.top <= i < self.top + rows and self.left <= j < self.left + cols):
+            self._scroll_to(i - rows//2, j - cols//2)
+
+    def _draw_cell(self, i, j):
+        rows, cols = self._get_viewport_size()
+        if not (self.top <= i < self.top + rows and self.left <= j < self.left + cols):
+            return
+        value = self.values[i, j]
+        text = self.format_cell(value)
+        attribute = get_attribute(LATEST_CELL if (i, j) == self.latest else FILLED_CELL)
+        try:
+            self.w.addstr(self.base_y + i - self.top,
+                          self.base_x + get_column(j - self.left, self.display_size),
+                          text, attribute if value != U.EMPTY_CELL else curses.A_NORMAL)
+        except curses.error:    # Writing to the bottom right corner of the screen
+            pass
+
+    def _draw_status(self):
+        height, width = self.w.getmaxyx()
+        status = "step {:d}/{:d}  {:.3g} steps/s{}  rows {:d}+ cols {:d}+  {}".format(
+            self.steps, self.n*self.n, self.speed, "  PAUSED" if self.paused else "",
+            self.top, self.left, self.HELP)
+        try:
+            self.w.addstr(height - 1, 0, status[:width - 1], get_attribute(STATUS))
+            self.w.clrtoeol()
+        except curses.error:
+            pass
+
+    def _draw_frame(self):
+        if self.following and self.latest is not None:
+            self._follow()
+        if self.needs_redraw:
+            rows, cols = self._get_viewport_size()
+            for y in range(self.base_y, self.base_y + rows):
+                self.w.move(y, self.base_x)
+                self.w.clrtoeol()
+            for i in range(self.top, self.top + rows):
+                for j in range(self.left, self.left + cols):
+                    self._draw_cell(i, j)
+            self.needs_redraw = False
+        else:
+            for i, j in self.changed:
+                self._draw_cell(i, j)
+        self.changed.clear()
+        self._draw_status()
+        self.w.noutrefresh()
+        curses.doupdate()
+        self.frame_time = time.monotonic()
+
+    def _handle_key(self, key):
+        if key in (ord("+"), ord("=")):
+            self.speed *= 2
+        elif key == ord("-"):
+            self.speed /= 2
+        elif key == ord(" "):
+            self.paused = not self.paused
+        elif key == ord("s"):
+            self.skipping, self.paused = True, False
+        elif key == ord("f"):
+            self.following = True
+        elif key in SCROLL_KEYS:
+            self.following = False
+            di, dj = SCROLL_KEYS[key]
+            self._scroll_to(self.top + di, self.left + dj)
+
+    def _handle_keys(self):
+        key = self.w.getch()
+        while key != -1:
+            self._handle_key(key)
+            key = self.w.getch()
+
+    def __call__(self, i, j, value):
+        previous, self.latest = self.latest, (i, j)
+        self.values[i, j] = value
+        self.steps += 1
+        if self.skipping:
+            return
+        self.changed.add((i, j))
+        if previous is not None:
+            self.changed.add(previous)
+        next_step_time = self.step_time + 1/self.speed
+        while True:
+            self._handle_keys()
+            now = time.monotonic()
+            if now - self.frame_time >= self.frame_seconds:
+                self._draw_frame()
+            if self.skipping or (not self.paused and now >= next_step_time):
+                break
+            wait = self.frame_seconds if self.paused else min(
+                next_step_time - now, self.frame_seconds - (now - self.frame_time))
+            curses.napms(max(1, int(1000*wait)))
+        # Don't rush through a burst of steps after falling behind
+        self.step_time = max(next_step_time, now - self.frame_seconds)
+
+    def finish(self):
+        # Show the whole (visible) square as it ended up
+        self.needs_redraw = True
+        self._draw_frame()
+
+    def wait_for_key(self, message="Press any key to continue..."):
+        # Scrolling still works; any other key ends the wait
+        self.following = False
+        self.w.nodelay(False)
+        while True:
+            height, width = self.w.getmaxyx()
+            try:
+                self.w.addstr(height - 1, 0, message[:width - 1], get_attribute(STATUS))
+                self.w.clrtoeol()
+            except curses.error:
+                pass
+            key = self.w.getch()
+            if key not in SCROLL_KEYS:
+                return key
+            self._handle_key(key)
+            self._draw_frame()
+
+def visualize(construct, n, speed=2.0, fps=30):
+    '''
+    Run construct(on_step) (which should build the n x n square, calling
+    on_step for every cell it fills) inside a curses window showing the
+    filling as it happens. Returns the square.
+    '''
+    magic_s, exception = None, None
+    w = curses_init()
+    try:
+        w.addstr(0, 0, "For an {:d} x {:d} magic square, the required sum is: {:d}".format(
+            n, n, U.calculate_required_sum(n)))
+        visualizer = CursesVisualizer(w, n, base_yx=(2, 0), speed=speed, fps=fps)
+        magic_s = construct(visualizer)
+        visualizer.finish()
+        visualizer.wait_for_key()
+    except:
+        exception = traceback.format_exc()     # print trace back log of the error
+    finally:
+        curses_close(w)
+    if exception is not None:
+        print("Exception occured!")
+        print(exception)
+    return magic_s
+
+if __name__ == "__main__":
+    from magic_square import MagicSquare
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    magic_s = visualize(lambda on_step: MagicSquare(n, on_step=on_step).construct(), n, speed=speed)
+    if magic_s is not None:
+        with U.better_np_printoptions(n):
+            print(magic_s)
+        U.verify_magic_square(magic_s)
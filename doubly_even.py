@@ -1,64 +1,56 @@
 import numpy as np
-from itertools import product
 import utilities as U
 
-def fill_square(n, forward=True):
-    sqr = np.arange(n**2) + 1
-    if not forward:
-        sqr = sqr[::-1]
-    return sqr.reshape((n, n))
-
-# The other version of this code is better
-# def get_submask_indices(row_range, col_range):
-    # https://stackoverflow.com/a/49805163
-    # Here row_range and col_range are after doing the np.arange
-    # return tuple(np.transpose(list(product(row_range, col_range))))
-
-def get_submask_indices(row_low, row_high, col_low, col_high):
-    # https://stackoverflow.com/a/41900850
-    rows, cols = zip(*product(np.arange(row_low, row_high),
-                        np.arange(col_low, col_high)))
-    return rows, cols
-
 def make_mask(n):
     U.assert_divisibility(n, 4)
-    k = U.get_k(n)
-    s = np.zeros((n, n))
-
-    # top left: i<k, j <k
-    s[get_submask_indices(0, k, 0, k)] = 1
-    # top right: i<k, j>3k
-    s[get_submask_indices(0, k, 3*k, n)] = 1
-    # bottom left: i>3k, j<k
-    s[get_submask_indices(3*k, n, 0, k)] = 1
-    # Bottom right: i > 3k, j > 3k
-    s[get_submask_indices(3*k, n, 3*k, n)] = 1
-    # Middle square
-    s[get_submask_indices(k, 3*k, k, 3*k)] = 1
+    s = np.ones((n, n), dtype=bool)
+    for rows, cols in U.get_doubly_even_unmasked_regions(n):
+        s[rows, cols] = False
 
     return s
 
-def construct_doubly_even_magic_square(n):
+def fill_doubly_even_stepwise(n, magic_s, on_step):
+    mask = make_mask(n).tolist()
+    magic_s.fill(U.EMPTY_CELL)
+    for forward in [True, False]:
+        for i in range(n):
+            for j in range(n):
+                if mask[i][j] == forward:
+                    magic_s[i, j] = i*n + j + 1 if forward else n*n - i*n - j
+                    on_step(i, j, magic_s[i, j])
+    return magic_s
+
+def construct_doubly_even_magic_square(n, on_step=None, out=None, dtype=None):
     '''
     This method was picked from the following WikiHow page on October 17, 2020.
 
     https://www.wikihow.com/Solve-a-Magic-Square#Solving-a-Doubly-Even-Magic-Square
+
+    The square is written straight into out (a fresh array of the given
+    dtype, by default the smallest that fits, if out is None), so repeated
+    builds can reuse the same memory.
+
+    If on_step is given, the cells are instead filled in one by one as on
+    paper, calling on_step(i, j, value) for each (e.g. a
+    curses_utilities.CursesVisualizer): counting forward through the cells
+    inside the mask, then backward through those outside it.
     '''
     U.assert_divisibility(n, 4)
-    # To fill counting forward
-    s_forward = fill_square(n)
-    # To fill counting backwards
-    s_backward = fill_square(n, forward=False)
-    # To decide when to fill forward and when backwards
-    mask = make_mask(n)
-    magic_s = np.zeros((n, n), dtype=int)
-    # The actual filling in according to the masking
-    magic_s = np.where(mask, s_forward, s_backward)
-    return magic_s
-
-n = 8
-print("\nFor an {:d} x {:d} magic square, the required sum is: {:d}\n".format(n, n, U.calculate_required_sum(n)))
-magic_s = construct_doubly_even_magic_square(n)
-U.set_better_np_printoptions(n)
-print(magic_s)
-U.verify_magic_square(magic_s)
+    out = U.get_output(n, out, dtype)
+    if on_step is not None:
+        return fill_doubly_even_stepwise(n, out, on_step)
+    # Fill everything counting forward: (i, j) gets i*n + j + 1
+    np.add(np.arange(0, n*n, n, dtype=out.dtype)[:, None],
+           np.arange(1, n+1, dtype=out.dtype), out=out)
+    # Outside the mask count backwards instead, which is n*n + 1 minus that.
+    for rows, cols in U.get_doubly_even_unmasked_regions(n):
+        np.subtract(n*n + 1, out[rows, cols], out=out[rows, cols])
+    return out
+
+if __name__ == "__main__":
+    n = 8
+    print("\nFor an {:d} x {:d} magic square, the required sum is: {:d}\n".format(n, n, U.calculate_required_sum(n)))
+    magic_s = construct_doubly_even_magic_square(n)
+    U.set_better_np_printoptions(n)
+    print(magic_s)
+    U.verify_magic_square(magic_s)
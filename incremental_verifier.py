@@ -0,0 +1,132 @@
+import numpy as np
+import utilities as U
+
+class IncrementalVerifier:
+    '''
+    Checks a square while it is being filled in, one cell at a time, as by
+    hand. It keeps the sum and the number of filled cells of every row,
+    column and diagonal, and how often each number has been used, so that
+    set_cell and clear_cell cost O(1) whatever n is, and the square is
+    never rescanned.
+
+    Both return the problems the change brought up, as (check, index, total)
+    tuples like those of U.VerificationResult: a line that is now complete
+    but doesn't add up to the required sum ("row", "column", "diagonal" or
+    "antidiagonal", with its sum), or a number now used twice ("duplicate",
+    with the number as index). failures lists all the current problems.
+    '''
+    def __init__(self, n, magic_s=None):
+        self.n = n
+        self.required_sum = U.calculate_required_sum(n)
+        self.magic_s = np.full((n, n), U.EMPTY_CELL, dtype=U.get_smallest_dtype(n))
+        self.filled = 0
+        # Indexed by line: the n rows, then the n columns, then the two diagonals
+        self.line_sums = [0]*(2*n + 2)
+        self.line_counts = [0]*(2*n + 2)
+        self.value_counts = np.zeros(n*n + 1, dtype=np.int64)
+        self.bad_lines = {}
+        self.duplicates = set()
+        if magic_s is not None:
+            self._load(magic_s)
+
+    def _load(self, magic_s):
+        # Start from a partly (or fully) filled square, counting everything at once
+        n = self.n
+        assert magic_s.shape == (n, n), "Input is not a {:d} x {:d} square".format(n, n)
+        assert magic_s.min() >= U.EMPTY_CELL and magic_s.max() <= n*n, \
+            "Numbers should be between 1 and {:d}".format(n*n)
+        self.magic_s[...] = magic_s
+        is_filled = magic_s != U.EMPTY_CELL
+        self.filled = int(is_filled.sum())
+        diagonal = np.arange(n)
+        sums = [magic_s.sum(1, dtype=np.int64), magic_s.sum(0, dtype=np.int64),
+                [magic_s[diagonal, diagonal].sum(dtype=np.int64)],
+                [magic_s[diagonal, n-1 - diagonal].sum(dtype=np.int64)]]
+        counts = [is_filled.sum(1), is_filled.sum(0),
+                  [is_filled[diagonal, diagonal].sum()], [is_filled[diagonal, n-1 - diagonal].sum()]]
+        self.line_sums = [int(total) for line_sums in sums for total in line_sums]
+        self.line_counts = [int(count) for line_counts in counts for count in line_counts]
+        self.bad_lines = {line: total for line, total in enumerate(self.line_sums)
+                          if self.line_counts[line] == n and total != self.required_sum}
+        self.value_counts = np.bincount(magic_s[is_filled].astype(np.intp), minlength=n*n + 1)
+        self.duplicates = set(np.flatnonzero(self.value_counts > 1).tolist())
+
+    def _get_lines(self, i, j):
+        n = self.n
+        lines = [i, n + j]
+        if i == j:
+            lines.append(2*n)
+        if i + j == n - 1:
+            lines.append(2*n + 1)
+        return lines
+
+    def _describe_line(self, line):
+        # The (check, index) of a line, as in U.VerificationResult
+        n = self.n
+        if line < n:
+            return "row", line
+        if line < 2*n:
+            return "column", line - n
+        return ("diagonal", 0) if line == 2*n else ("antidiagonal", 0)
+
+    def _update(self, i, j, value):
+        # Negative indices would wrap around in magic_s but not in _get_lines
+        assert 0 <= i < self.n and 0 <= j < self.n, \
+            "({}, {}) is not a cell of the {:d} x {:d} square".format(i, j, self.n, self.n)
+        old = int(self.magic_s[i, j])
+        problems = []
+        if old == value:
+            return problems
+        self.magic_s[i, j] = value
+        filled_change = (value != U.EMPTY_CELL) - (old != U.EMPTY_CELL)
+        self.filled += filled_change
+
+        if old != U.EMPTY_CELL:
+            self.value_counts[old] -= 1
+            if self.value_counts[old] <= 1:
+                self.duplicates.discard(old)
+        if value != U.EMPTY_CELL:
+            self.value_counts[value] += 1
+            if self.value_counts[value] > 1:
+                self.duplicates.add(value)
+                problems.append(("duplicate", value, None))
+
+        for line in self._get_lines(i, j):
+            self.line_sums[line] += value - old
+            self.line_counts[line] += filled_change
+            if self.line_counts[line] == self.n and self.line_sums[line] != self.required_sum:
+                self.bad_lines[line] = self.line_sums[line]
+                problems.append(self._describe_line(line) + (self.line_sums[line],))
+            else:
+                self.bad_lines.pop(line, None)
+        return problems
+
+    def set_cell(self, i, j, value):
+        value = int(value)
+        assert 1 <= value <= self.n*self.n, \
+            "{:d} is not between 1 and {:d}".format(value, self.n*self.n)
+        return self._update(i, j, value)
+
+    def clear_cell(self, i, j):
+        return self._update(i, j, U.EMPTY_CELL)
+
+    @property
+    def failures(self):
+        return ([self._describe_line(line) + (total,) for line, total in sorted(self.bad_lines.items())]
+                + [("duplicate", value, None) for value in sorted(self.duplicates)])
+
+    @property
+    def is_complete(self):
+        return self.filled == self.n*self.n
+
+    @property
+    def is_magic(self):
+        # With every cell filled and no duplicates, the numbers are exactly 1 to n*n
+        return self.is_complete and not self.bad_lines and not self.duplicates
+
+    def __bool__(self):
+        return self.is_magic
+
+    def __repr__(self):
+        return "IncrementalVerifier(n={:d}, {:d}/{:d} filled, {:d} problems)".format(
+            self.n, self.filled, self.n*self.n, len(self.bad_lines) + len(self.duplicates))
@@ -0,0 +1,164 @@
+import time
+import logging
+import threading
+
+class NullPhase:
+    # Stands in for a Phase while instrumentation is off, doing nothing
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    # Setting n (once it is known) is ignored
+    n = property(lambda self: 0, lambda self, n: None)
+
+# Handed out by phase while instrumentation is off, so that costs next to nothing
+NULL_PHASE = NullPhase()
+
+class Phase:
+    # Times one run of a phase and hands it to its Instrumentation. Set n
+    # inside the with block if it isn't known when the phase starts.
+    __slots__ = ["instrumentation", "name", "n", "start"]
+
+    def __init__(self, instrumentation, name, n):
+        self.instrumentation, self.name, self.n = instrumentation, name, n
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.record(self.name, self.n, time.perf_counter() - self.start)
+        return False
+
+class Instrumentation:
+    '''
+    Timers and counters for the phases of making squares (construct,
+    verify, format, ...) kept per phase and n, so that a regression can be
+    pinned on a phase and a size. Off by default; while off, phase hands
+    out a shared do-nothing context and count returns at once.
+
+    Every timing and count is also passed to each sink, a callable taking
+    a dict: {"kind": "phase", "phase", "n", "seconds"} or
+    {"kind": "counter", "counter", "n", "amount"}. See LoggingSink, and
+    to_prometheus for a text dump of the totals.
+    '''
+    def __init__(self, enabled=False, sinks=None):
+        self.enabled = enabled
+        self.sinks = [] if sinks is None else list(sinks)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            # (phase, n) -> [calls, total seconds, max seconds]
+            self.phases = {}
+            # (counter, n) -> total
+            self.counters = {}
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def phase(self, name, n=0):
+        # with instrumentation.phase("construct", n): ...
+        if not self.enabled:
+            return NULL_PHASE
+        return Phase(self, name, n)
+
+    def record(self, name, n, seconds):
+        with self._lock:
+            stats = self.phases.setdefault((name, n), [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+        for sink in self.sinks:
+            sink({"kind": "phase", "phase": name, "n": n, "seconds": seconds})
+
+    def count(self, name, n=0, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[(name, n)] = self.counters.get((name, n), 0) + amount
+        for sink in self.sinks:
+            sink({"kind": "counter", "counter": name, "n": n, "amount": amount})
+
+    def snapshot(self):
+        # The totals so far, as plain dicts
+        with self._lock:
+            return {"phases": [{"phase": name, "n": n, "calls": calls,
+                                "seconds": seconds, "max_seconds": max_seconds}
+                               for (name, n), (calls, seconds, max_seconds) in sorted(self.phases.items())],
+                    "counters": [{"counter": name, "n": n, "total": total}
+                                 for (name, n), total in sorted(self.counters.items())]}
+
+    def to_prometheus(self, prefix="magic_square"):
+        '''
+        The totals in the Prometheus text exposition format, labelled by
+        phase (or counter) and n.
+        '''
+        snapshot = self.snapshot()
+        lines = []
+        for metric, kind, key, help_text in [
+                ("phase_calls_total", "counter", "calls", "Runs of each phase"),
+                ("phase_seconds_total", "counter", "seconds", "Time spent in each phase"),
+                ("phase_max_seconds", "gauge", "max_seconds", "Longest run of each phase")]:
+            lines.append("# HELP {}_{} {}".format(prefix, metric, help_text))
+            lines.append("# TYPE {}_{} {}".format(prefix, metric, kind))
+            for stats in snapshot["phases"]:
+                lines.append('{}_{}{{phase="{}",n="{:d}"}} {}'.format(
+                    prefix, metric, stats["phase"], stats["n"], stats[key]))
+        lines.append("# HELP {}_events_total Counted events".format(prefix))
+        lines.append("# TYPE {}_events_total counter".format(prefix))
+        for stats in snapshot["counters"]:
+            lines.append('{}_events_total{{counter="{}",n="{:d}"}} {}'.format(
+                prefix, stats["counter"], stats["n"], stats["total"]))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix="magic_square"):
+        # For the textfile collector of node_exporter, say
+        with open(path, "w") as f:
+            f.write(self.to_prometheus(prefix))
+
+class LoggingSink:
+    # A sink logging every timing and count
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logging.getLogger("magic_square") if logger is None else logger
+        self.level = level
+
+    def __call__(self, event):
+        if event["kind"] == "phase":
+            self.logger.log(self.level, "%s n=%d took %.6fs", event["phase"], event["n"], event["seconds"])
+        else:
+            self.logger.log(self.level, "%s n=%d +%d", event["counter"], event["n"], event["amount"])
+
+# The instrumentation used by MagicSquare and utilities
+default = Instrumentation()
+
+def phase(name, n=0):
+    return default.phase(name, n)
+
+def count(name, n=0, amount=1):
+    default.count(name, n, amount)
+
+def enable(*sinks):
+    # Turn the default instrumentation on, adding any sinks given
+    for sink in sinks:
+        default.add_sink(sink)
+    default.enable()
+    return default
+
+def disable():
+    default.disable()
@@ -0,0 +1,78 @@
+import numpy as np
+import utilities as U
+from magic_square import Evenness
+
+class LazyMagicSquare:
+    '''
+    The same square MagicSquare(n).construct() gives, without ever building
+    it: every cell is computed on demand from the closed form of its method
+    (U.siamese_values, U.lux_values or U.doubly_even_values). A cell costs
+    O(1) and a row, column or diagonal O(n), so this works for n far too
+    big to hold in memory.
+
+    Indexing works like on a NumPy array: square[i, j], square[i],
+    square[:, j], square[a:b, c:d], or pointwise with two integer arrays.
+    '''
+    def __init__(self, n):
+        assert n > 0 and n != 2, "There is no {:d} x {:d} magic square".format(n, n)
+        self.n = n
+        self.shape = (n, n)
+        self.required_sum = U.calculate_required_sum(n)
+        if U.is_divisible(n, 4):
+            self.evenness, self.values = Evenness.DoublyEven, U.doubly_even_values
+        elif U.is_divisible(n, 2):
+            self.evenness, self.values = Evenness.SinglyEven, U.lux_values
+        else:
+            self.evenness, self.values = Evenness.Odd, U.siamese_values
+
+    def __len__(self):
+        return self.n
+
+    def __repr__(self):
+        return "LazyMagicSquare(n={:d}, {})".format(self.n, self.evenness.name)
+
+    def _check_index(self, i):
+        assert -self.n <= i < self.n, "Index {:d} out of range for n = {:d}".format(i, self.n)
+        return i % self.n
+
+    def cell(self, i, j):
+        return int(self.values(self.n, self._check_index(i), self._check_index(j)))
+
+    def row(self, i):
+        return self.values(self.n, self._check_index(i), np.arange(self.n))
+
+    def col(self, j):
+        return self.values(self.n, np.arange(self.n), self._check_index(j))
+
+    def diag(self):
+        # Main diagonal, top left to bottom right
+        return self.values(self.n, np.arange(self.n), np.arange(self.n))
+
+    def antidiag(self):
+        # The other diagonal, from the top right corner down to the bottom left
+        return self.values(self.n, np.arange(self.n), np.arange(self.n)[::-1])
+
+    def _get_indices(self, key):
+        # Indices selected by key along one axis, and whether key was an array
+        if isinstance(key, slice):
+            return np.arange(*key.indices(self.n)), False
+        key = np.asarray(key)
+        assert key.dtype.kind in "iu", "Only integers, slices and integer arrays can index"
+        assert np.all((-self.n <= key) & (key < self.n)), "Index out of range for n = {:d}".format(self.n)
+        return key % self.n, key.ndim > 0
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        assert len(key) <= 2, "A square only has two axes"
+        key = key + (slice(None),)*(2 - len(key))
+        (rows, rows_are_array), (cols, cols_are_array) = map(self._get_indices, key)
+        if not (rows_are_array and cols_are_array):
+            # Each axis is selected independently, as with basic indexing
+            rows = rows.reshape(rows.shape + (1,)*cols.ndim)
+        values = self.values(self.n, rows, cols)
+        return int(values) if values.ndim == 0 else values
+
+    def to_array(self, dtype=None):
+        # Materialize the whole square (only sensible for smaller n)
+        return np.asarray(self[:, :], dtype=U.get_dtype(self.n, dtype))
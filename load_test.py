@@ -0,0 +1,105 @@
+import io
+import time
+import asyncio
+import argparse
+import numpy as np
+from magic_square import MagicSquare
+
+async def open_connection(host, port, unix_path):
+    if unix_path is not None:
+        return await asyncio.open_unix_connection(unix_path)
+    return await asyncio.open_connection(host, port)
+
+async def request(reader, writer, method, target, body=b""):
+    '''
+    Send one HTTP/1.1 request on an open connection and read the whole
+    response, chunked or not. Returns (status, headers, body).
+    '''
+    writer.write("{} {} HTTP/1.1\r\nHost: magic\r\nContent-Length: {:d}\r\n\r\n".format(
+        method, target, len(body)).encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding") == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            chunk = await reader.readexactly(size + 2)
+            if size == 0:
+                break
+            chunks.append(chunk[:-2])
+        return status, headers, b"".join(chunks)
+    return status, headers, await reader.readexactly(int(headers.get("content-length", 0)))
+
+def get_percentile(latencies, q):
+    return float(np.percentile(latencies, q)) if latencies else float("nan")
+
+async def run_load_test(targets, requests=1000, concurrency=32, host="127.0.0.1",
+                        port=8000, unix_path=None):
+    '''
+    Send requests requests, cycling through targets ((method, path, body)
+    tuples), over concurrency connections each sending one request at a
+    time. Returns the latency percentiles (in seconds), throughput and
+    count of failed (non 200) responses.
+    '''
+    latencies, failures, received = [], 0, 0
+    next_request = iter(range(requests))
+
+    async def client():
+        nonlocal failures, received
+        reader, writer = await open_connection(host, port, unix_path)
+        try:
+            for index in next_request:
+                method, target, body = targets[index % len(targets)]
+                start = time.perf_counter()
+                status, _, response = await request(reader, writer, method, target, body)
+                latencies.append(time.perf_counter() - start)
+                failures += status != 200
+                received += len(response)
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    seconds = time.perf_counter() - start
+    return {"requests": len(latencies), "failures": failures, "seconds": seconds,
+            "requests_per_second": len(latencies)/seconds,
+            "megabytes_per_second": received/seconds/2**20,
+            "p50_seconds": get_percentile(latencies, 50),
+            "p99_seconds": get_percentile(latencies, 99),
+            "max_seconds": max(latencies, default=float("nan"))}
+
+def get_targets(ns, fmt="raw", verify=False):
+    # Construct requests for each n, plus (with verify) a verify request of each square
+    targets = [("GET", "/construct?n={:d}&format={}".format(n, fmt), b"") for n in ns]
+    if verify:
+        for n in ns:
+            body = io.BytesIO()
+            np.save(body, MagicSquare(n).construct())
+            targets.append(("POST", "/verify?format=npy", body.getvalue()))
+    return targets
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test a running server.py.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix", default=None)
+    parser.add_argument("--n", type=int, nargs="+", default=[101, 102, 104])
+    parser.add_argument("--format", default="raw", choices=["csv", "raw", "npy"])
+    parser.add_argument("--verify", action="store_true", help="also send verify requests")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    report = asyncio.run(run_load_test(get_targets(args.n, args.format, args.verify),
+                                       requests=args.requests, concurrency=args.concurrency,
+                                       host=args.host, port=args.port, unix_path=args.unix))
+    print("{requests:d} requests ({failures:d} failed) in {seconds:.2f}s: "
+          "{requests_per_second:.1f} requests/s, {megabytes_per_second:.1f} MB/s".format(**report))
+    print("latency p50 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms".format(
+        1000*report["p50_seconds"], 1000*report["p99_seconds"], 1000*report["max_seconds"]))
@@ -1,7 +1,10 @@
+import os
 import numpy as np
 from itertools import product
-from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum, IntEnum
 import utilities as U
+import instrumentation as I
 
 class Evenness(Enum):
     Odd = 1
@@ -11,13 +14,176 @@ class Evenness(Enum):
     def __repr__(self):
         return self.name
 
+# How the walk of a pen and paper method got to a cell
+class Move(IntEnum):
+    Start = 0           # The first cell filled
+    Diagonal = 1        # Up and right, as in the Siamese method
+    Drop = 2            # Down, the cell up and right being taken
+    InBlock = 3         # The other 3 cells of a block of the LUX method
+    Forward = 4         # Counting forward, inside the doubly even mask
+    Backward = 5        # Counting backward, outside it
+
+    def __repr__(self):
+        return self.name
+
+# The types of blocks of the LUX method, as held in the LUX square
+class Block(IntEnum):
+    L = 0
+    U = 1
+    X = 2
+
+    def __repr__(self):
+        return self.name
+
+# The block of a step event that isn't from the LUX method
+NO_BLOCK = -1
+
+# One step event of MagicSquare.trace, when they come in NumPy arrays
+TRACE_DTYPE = np.dtype([("i", np.int32), ("j", np.int32), ("value", np.uint64),
+                        ("move", np.int8), ("block", np.int8)])
+
+def make_LUX_square(k):
+    # assert_indivisibility(odd_num, 2)
+    LUX = np.zeros((2*k+1, 2*k+1), dtype=np.int8)
+    # Fill first n+1 with L
+    LUX[:k+1, :] = Block.L
+    # Fill next with U
+    LUX[k+1, :] = Block.U
+    # Fill remaining n-1 with X
+    LUX[k+2:, :] = Block.X
+    # Swap middle U with the L above it.
+    LUX[k, k] = Block.U
+    LUX[k+1, k] = Block.L
+    return LUX
+
+def get_evenness(n):
+    if U.is_divisible(n, 4):
+        return Evenness.DoublyEven
+    elif U.is_divisible(n, 2):
+        return Evenness.SinglyEven
+    else:
+        return Evenness.Odd
+
+class Method:
+    '''
+    One way of building squares, for the registry METHODS. construct(ms,
+    out=None) builds the square of the MagicSquare ms (into out if given)
+    for n of the given evenness classes (and, if can_build is given, for
+    which can_build(n) is true), and fill_rows(n, out, row_start), if
+    there is one, fills any band of rows of that same square.
+
+    Every method declares its cost, which is what "auto" picks by: about
+    setup_seconds + row_seconds*n + cell_seconds*n*n to build, and at peak
+    the square itself plus scratch_items extra items of its dtype and
+    scratch_bytes bytes per cell. The numbers are rough fits to timings of
+    building into an existing array, good for comparing methods rather
+    than as promises. A method built from other squares can also give
+    extra_seconds(n), the time to build those, added to its estimate.
+    '''
+    def __init__(self, name, evenness, construct, fill_rows=None, pen_and_paper=False,
+                 setup_seconds=0.0, row_seconds=0.0, cell_seconds=0.0,
+                 scratch_items=0.0, scratch_bytes=0.0, can_build=None, extra_seconds=None,
+                 description=""):
+        self.name = name
+        self.evenness = evenness
+        self.can_build = can_build
+        self.construct = construct
+        self.fill_rows = fill_rows
+        # Whether the cells are filled one by one (so on_step and trace work)
+        self.pen_and_paper = pen_and_paper
+        self.setup_seconds, self.row_seconds, self.cell_seconds = setup_seconds, row_seconds, cell_seconds
+        self.scratch_items, self.scratch_bytes = scratch_items, scratch_bytes
+        self.extra_seconds = extra_seconds
+        self.description = description
+
+    def accepts(self, n):
+        if n < 1 or n == 2 or get_evenness(n) not in self.evenness:
+            return False
+        return self.can_build is None or self.can_build(n)
+
+    def estimate_seconds(self, n):
+        extra_seconds = 0.0 if self.extra_seconds is None else self.extra_seconds(n)
+        return self.setup_seconds + self.row_seconds*n + self.cell_seconds*n*n + extra_seconds
+
+    def estimate_bytes(self, n, dtype=None):
+        itemsize = U.get_dtype(n, dtype).itemsize
+        return int(n*n*(itemsize*(1 + self.scratch_items) + self.scratch_bytes))
+
+    def __repr__(self):
+        return "Method({})".format(self.name)
+
+# The registered methods by name, see register_method
+METHODS = {}
+
+# The method used for each evenness class unless another is asked for, by
+# hand (pen_and_paper) or not. They all give the same square.
+DEFAULT_METHODS = {Evenness.Odd: "siamese", Evenness.SinglyEven: "lux",
+                   Evenness.DoublyEven: "doubly_even"}
+PEN_AND_PAPER_METHODS = {Evenness.Odd: "siamese_walk", Evenness.SinglyEven: "lux_walk",
+                         Evenness.DoublyEven: "doubly_even_walk"}
+
+def register_method(method):
+    # Add a Method to the registry, so MagicSquare(n, method=name) and "auto" can use it
+    assert method.name not in METHODS and method.name != "auto", \
+        "There already is a method called {}".format(method.name)
+    METHODS[method.name] = method
+    return method
+
+def get_methods(n, pen_and_paper=False):
+    # The registered methods that can build the n x n square
+    return [method for method in METHODS.values()
+            if method.accepts(n) and method.pen_and_paper == pen_and_paper]
+
+def choose_method(n, dtype=None, memory_budget=None, pen_and_paper=False):
+    '''
+    The method estimated to build the n x n square of dtype fastest, among
+    those whose estimated peak memory is within memory_budget bytes (if
+    given). For squares that fit no budget see construct_to_file.
+    '''
+    methods = [method for method in get_methods(n, pen_and_paper)
+               if memory_budget is None or method.estimate_bytes(n, dtype) <= memory_budget]
+    assert methods, "No method builds the {:d} x {:d} square within {} bytes".format(n, n, memory_budget)
+    return min(methods, key=lambda method: method.estimate_seconds(n))
+
+def get_method(n, method=None, dtype=None, memory_budget=None, pen_and_paper=False):
+    '''
+    The Method to build the n x n square with: the one named, the cheapest
+    one for "auto" (see choose_method), or for None the usual one of n's
+    evenness class.
+    '''
+    if method == "auto":
+        return choose_method(n, dtype, memory_budget, pen_and_paper)
+    if method is None:
+        method = (PEN_AND_PAPER_METHODS if pen_and_paper else DEFAULT_METHODS)[get_evenness(n)]
+    assert method in METHODS, "method should be one of {}".format(["auto"] + list(METHODS))
+    method = METHODS[method]
+    assert method.accepts(n), "{} can't build a {:d} x {:d} square".format(method.name, n, n)
+    assert method.pen_and_paper or not pen_and_paper, \
+        "{} doesn't fill the cells one by one".format(method.name)
+    return method
+
 class MagicSquare:
-    def __init__(self, n=None, verbose=False):
+    def __init__(self, n=None, verbose=False, pen_and_paper=False, dtype=None,
+                 on_step=None, method=None, memory_budget=None):
         if n is None:
             print("Setting n to default of 3")
             n = 3
         self.n = n
         self.verbose=verbose
+        # Replay the human methods step by step instead of computing
+        # the cells directly (slow, but the order of filling is kept).
+        self.pen_and_paper = pen_and_paper
+        # Called as on_step(i, j, value) for every cell filled, e.g. by a
+        # curses_utilities.CursesVisualizer. Implies pen_and_paper.
+        self.on_step = on_step
+        if on_step is not None:
+            self.pen_and_paper = True
+        # The smallest unsigned dtype holding n*n, unless one is asked for
+        self.dtype = U.get_dtype(n, dtype)
+        # A registered method's name, "auto" for the cheapest one within
+        # memory_budget bytes, or None for the usual one (see get_method)
+        self.method = get_method(n, method, self.dtype, memory_budget, self.pen_and_paper)
+        self.pen_and_paper = self.method.pen_and_paper
         self._set_values()
 
     def _set_values(self):
@@ -25,31 +191,120 @@ class MagicSquare:
         self.required_sum = U.calculate_required_sum(n)
         self.evenness = self.set_evenness()
         self.magic_s = None
-        self.choices = {Evenness.DoublyEven: self._construct_doubly_even,
-                        Evenness.SinglyEven: self._construct_singly_even,
-                        Evenness.Odd: self._construct_odd}
-        U.set_better_np_printoptions(n)
+        # The pen and paper walks, yielding a step event for every cell filled
+        self.walks = {Evenness.DoublyEven: self._walk_doubly_even,
+                      Evenness.SinglyEven: self._walk_singly_even,
+                      Evenness.Odd: self._walk_odd}
 
     def set_evenness(self):
-        n = self.n
-        if U.is_divisible(n, 4):
-            return Evenness.DoublyEven
-        elif U.is_divisible(n, 2):
-            return Evenness.SinglyEven
-        else:
-            return Evenness.Odd
+        return get_evenness(self.n)
 
     def run(self):
         n = self.n
         print("\nFor an {:d} x {:d} magic square, the required sum is: {:d}\n".format(n, n, self.required_sum))
         magic_s = self.construct()
-        print(magic_s)
+        with I.phase("format", n), U.better_np_printoptions(n):
+            print(magic_s)
         self.verify()
 
-    def construct(self):
-        self.magic_s = self.choices[self.evenness]()
+    def construct(self, out=None, workers=1):
+        '''
+        Build the square, into out if given (so that a buffer can be refilled
+        without reallocating), else into a new array of self.dtype.
+
+        With workers other than 1 (None for one per core) the rows are
+        split into tiles filled in parallel on a thread pool, see
+        _construct_tiles.
+        '''
+        assert workers is None or workers >= 1, "workers should be None or at least 1"
+        with I.phase("construct", self.n):
+            if workers == 1:
+                self.magic_s = self.method.construct(self, out=out)
+            else:
+                self.magic_s = self._construct_tiles(out, workers)
+        I.count("cells_constructed", self.n, self.n*self.n)
         return self.magic_s
 
+    def _construct_tiles(self, out=None, workers=None, max_tile_bytes=2**22):
+        '''
+        Fill the square a tile of rows at a time on a pool of workers threads,
+        each tile from the band filler of the method (so its temporaries are
+        tile sized, not n x n). NumPy lets go of the GIL inside its loops,
+        so the threads really do run at the same time. There are at least
+        4 tiles per worker, to keep them all busy to the end.
+        '''
+        n = self.n
+        fill_rows = self.method.fill_rows
+        assert fill_rows is not None and not self.pen_and_paper, \
+            "{} can't be built in tiles".format(self.method.name)
+        magic_s = U.get_output(n, out, self.dtype)
+        workers = os.cpu_count() if workers is None else workers
+        tile_rows = min(U.get_band_rows(n, magic_s.dtype, max_tile_bytes), -(-n // (4*workers)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # list, so that any exception in a tile is raised here
+            list(executor.map(lambda row_start: fill_rows(n, magic_s[row_start:row_start+tile_rows], row_start),
+                              range(0, n, tile_rows)))
+        return magic_s
+
+    def trace(self, chunk_size=None):
+        '''
+        Build the square by hand (as with pen_and_paper), yielding a step
+        event for every cell as it is filled: (i, j, value, move, block),
+        move being how the walk got there (a Move) and block the type of
+        LUX block (a Block) or NO_BLOCK. With chunk_size the events come
+        instead as TRACE_DTYPE arrays of up to chunk_size events each. The
+        finished square is then in self.magic_s.
+
+        None of this runs unless asked for: construct doesn't trace.
+        See tracing.py to record traces to disk and replay them. The walks
+        give the usual square of each evenness class, so only methods that
+        build that square can be traced.
+        '''
+        assert self.method.fill_rows is METHODS[DEFAULT_METHODS[self.evenness]].fill_rows, \
+            "{} builds a different square than the walk, so it can't be traced".format(self.method.name)
+        self.magic_s = U.get_output(self.n, None, self.dtype)
+        walk = self.walks[self.evenness](self.magic_s)
+        if chunk_size is None:
+            yield from walk
+            return
+        chunk, count = np.empty(chunk_size, dtype=TRACE_DTYPE), 0
+        for event in walk:
+            chunk[count] = event
+            count += 1
+            if count == chunk_size:
+                yield chunk
+                chunk, count = np.empty(chunk_size, dtype=TRACE_DTYPE), 0
+        if count:
+            yield chunk[:count]
+
+    def construct_to_file(self, path, dtype=None, max_band_bytes=2**26):
+        '''
+        Write the square into the .npy file at path one band of rows at a
+        time, computing each band from the closed form of its method. Only
+        one band (at most max_band_bytes) is ever held in memory, so this
+        works for squares far bigger than RAM. Load the result with
+        np.load(path, mmap_mode="r") and check it with verify_file.
+        '''
+        n = self.n
+        dtype = self.dtype if dtype is None else U.get_dtype(n, dtype)
+        fill_band = self.method.fill_rows
+        assert fill_band is not None, "{} can't build a square by bands".format(self.method.name)
+        band_rows = U.get_band_rows(n, dtype, max_band_bytes)
+        band = np.empty((band_rows, n), dtype=dtype)
+        with I.phase("construct_to_file", n), open(path, "wb") as f:
+            U.write_npy_header(f, (n, n), dtype)
+            for row_start in range(0, n, band_rows):
+                rows = min(band_rows, n - row_start)
+                fill_band(n, band[:rows], row_start)
+                band[:rows].tofile(f)
+        return path
+
+    def verify_file(self, path, max_band_bytes=2**26, print_message=True,
+                    stop_early=True, check_permutation=False):
+        return U.verify_magic_square_file(path, max_band_bytes=max_band_bytes,
+                                          print_message=print_message, stop_early=stop_early,
+                                          check_permutation=check_permutation)
+
     def get_magic_s(self):
         if self.magic_s is None:
             self.construct()
@@ -62,165 +317,276 @@ class MagicSquare:
                print_square=False, print_message=True, print_verbose=None):
         if magic_s is None:
             magic_s=self.get_magic_s()
-        if print_square:
-            print("\nWe'll now verify the following square:")
-            print(magic_s)
-        print_verbose = self.verbose if print_verbose is None else print_verbose
-        return U.verify_magic_square(magic_s,
-                                     print_message=print_message,
-                                     print_verbose=print_verbose)
+        with U.better_np_printoptions(magic_s.shape[0]):
+            if print_square:
+                with I.phase("format", magic_s.shape[0]):
+                    print("\nWe'll now verify the following square:")
+                    print(magic_s)
+            print_verbose = self.verbose if print_verbose is None else print_verbose
+            return U.verify_magic_square(magic_s,
+                                         print_message=print_message,
+                                         print_verbose=print_verbose)
+
+    def check(self, magic_s=None, stop_early=True, check_permutation=True):
+        '''
+        Like verify, but silent and fast: a single pass that can stop at the
+        first failure and also checks that the numbers are 1 to n*n.
+        Returns a U.VerificationResult, which is truthy for magic squares.
+        '''
+        if magic_s is None:
+            magic_s = self.get_magic_s()
+        return U.check_magic_square(magic_s, stop_early=stop_early,
+                                    check_permutation=check_permutation)
 
     # The functions below are lifted from their individual files
     # The individual files are better if you want to understand what
     # each internal function does, and just to play around with.
     # This class if more in case someone wants the final working set.
-    def _construct_odd(self):
+    def _construct_odd(self, out=None):
         '''
         This follows the Siamese method, which isn't the best for a computer,
         but is very easy for a human for follow. This function allows comparing
         a human constructed magic square to one a computer generates and verifies.
 
+        Unless pen_and_paper is set, the cells are computed directly from
+        the closed form of the walk, which gives exactly the same square.
+
         Reference: https://en.wikipedia.org/wiki/Siamese_method
         '''
         n = self.n
         U.assert_indivisibility(n, 2)
-        magic_s = np.full((n, n), U.EMPTY_CELL, dtype=int)
+        magic_s = U.get_output(n, out, self.dtype)
+        if not self.pen_and_paper:
+            return U.fill_siamese_rows(n, magic_s)
+        self._run_walk(self._walk_odd(magic_s))
+        return magic_s
+
+    def _construct_odd_broadcast(self, out=None):
+        '''
+        The same Siamese square, with the closed form evaluated over the
+        whole grid at once. For small n that beats filling it row by row,
+        but it needs a few n x n int64 temporaries, so not for big n.
+        '''
+        n = self.n
+        U.assert_indivisibility(n, 2)
+        magic_s = U.get_output(n, out, self.dtype)
+        magic_s[...] = U.siamese_values(n, np.arange(n)[:, None], np.arange(n))
+        return magic_s
+
+    def _walk_odd(self, magic_s):
+        # The Siamese walk, yielding a step event for every cell it fills
+        n = self.n
+        magic_s.fill(U.EMPTY_CELL)
         # Start from 1
         current_num = 1
         # First cell to fill is the middle one on the top row.
         i, j = 0, U.get_k(n)
+        move = Move.Start
         while current_num <= n**2:
             magic_s[i, j] = current_num
+            yield i, j, current_num, move, NO_BLOCK
             # Move up and right
             new_i, new_j = (i-1)%n, (j+1)%n
+            move = Move.Diagonal
             if magic_s[new_i, new_j] != U.EMPTY_CELL:
                 # If that is already filled, drop down instead.
                 new_i, new_j = i+1, j
+                move = Move.Drop
             i, j = new_i, new_j
             current_num +=1         # Will now fill in the next number
 
-        return magic_s
-
-    def _construct_doubly_even(self):
+    def _construct_doubly_even(self, out=None):
         '''
         This method was picked from the following WikiHow page on October 17, 2020.
 
         https://www.wikihow.com/Solve-a-Magic-Square#Solving-a-Doubly-Even-Magic-Square
+
+        The square is written straight into out (a fresh array of self.dtype
+        if out is None), so repeated builds can reuse the same memory.
+
+        With pen_and_paper the cells are filled in one by one instead:
+        counting forward through the cells inside the mask, then backward
+        through those outside it.
         '''
         n = self.n
-
-        def fill_square(n, forward=True):
-            sqr = np.arange(n**2) + 1
-            if not forward:
-                sqr = sqr[::-1]
-            return sqr.reshape((n, n))
-
-        def get_submask_indices(row_low, row_high, col_low, col_high):
-            # https://stackoverflow.com/a/41900850
-            rows, cols = zip(*product(np.arange(row_low, row_high),
-                                np.arange(col_low, col_high)))
-            return rows, cols
-
-        def make_mask(n):
-            U.assert_divisibility(n, 4)
-            k = U.get_k(n)
-            s = np.zeros((n, n))
-
-            # top left: i<k, j <k
-            s[get_submask_indices(0, k, 0, k)] = 1
-            # top right: i<k, j>3k
-            s[get_submask_indices(0, k, 3*k, n)] = 1
-            # bottom left: i>3k, j<k
-            s[get_submask_indices(3*k, n, 0, k)] = 1
-            # Bottom right: i > 3k, j > 3k
-            s[get_submask_indices(3*k, n, 3*k, n)] = 1
-            # Middle square
-            s[get_submask_indices(k, 3*k, k, 3*k)] = 1
-
-            return s
-
-        # To fill counting forward
-        s_forward = fill_square(n)
-        # To fill counting backwards
-        s_backward = fill_square(n, forward=False)
-        # To decide when to fill forward and when backwards
-        mask = make_mask(n)
-        self.magic_s = np.zeros((n, n), dtype=int)
-        # The actual filling in according to the masking
-        self.magic_s = np.where(mask, s_forward, s_backward)
+        U.assert_divisibility(n, 4)
+        out = U.get_output(n, out, self.dtype)
+        if self.pen_and_paper:
+            self._run_walk(self._walk_doubly_even(out))
+            self.magic_s = out
+            return self.magic_s
+        # Fill everything counting forward: (i, j) gets i*n + j + 1
+        np.add(np.arange(0, n*n, n, dtype=out.dtype)[:, None],
+               np.arange(1, n+1, dtype=out.dtype), out=out)
+        # Outside the mask count backwards instead, which is n*n + 1 minus that.
+        for rows, cols in U.get_doubly_even_unmasked_regions(n):
+            np.subtract(n*n + 1, out[rows, cols], out=out[rows, cols])
+        self.magic_s = out
         return self.magic_s
 
-    def _construct_singly_even(self):
+    def _walk_doubly_even(self, magic_s):
+        # Count through the cells twice, yielding a step event for every cell filled
+        n = self.n
+        mask = np.ones((n, n), dtype=bool)
+        for rows, cols in U.get_doubly_even_unmasked_regions(n):
+            mask[rows, cols] = False
+        mask = mask.tolist()
+        magic_s.fill(U.EMPTY_CELL)
+        for move in [Move.Forward, Move.Backward]:
+            forward = move is Move.Forward
+            for i in range(n):
+                for j in range(n):
+                    if mask[i][j] == forward:
+                        value = i*n + j + 1 if forward else n*n - i*n - j
+                        magic_s[i, j] = value
+                        yield i, j, value, move, NO_BLOCK
+
+    def _construct_singly_even(self, out=None):
         '''
         This uses Conway's LUX method, which may not be the best for a computer,
         but is very easy for a human for follow. Hence this allows comparing
         a human constructed magic square to one a computer generates and verifies.
 
+        Unless pen_and_paper is set, all the L, U and X blocks are placed at
+        once from the Siamese order of their LUX cells, giving the same square.
+        The LUX square holds Block values as small integers.
+
         Reference: https://en.wikipedia.org/wiki/Conway%27s_LUX_method_for_magic_squares
         '''
         n = self.n
-
-        class Block(Enum):
-            L = -1
-            U = 0
-            X = 1
-
-            def __repr__(self):
-                return self.name
-
-        def make_LUX_square(k):
-            # assert_indivisibility(odd_num, 2)
-            LUX = np.zeros((2*k+1, 2*k+1), dtype=Block)
-            # Fill first n+1 with L
-            LUX[:k+1, :] = Block.L
-            # Fill next with U
-            LUX[k+1, :] = Block.U
-            # Fill remaining n-1 with X
-            LUX[k+2:, :] = Block.X
-            # Swap middle U with the L above it.
-            LUX[k, k] = Block.U
-            LUX[k+1, k] = Block.L
-            return LUX
-
-        def fill_block(magic_s, block, i, j, LUX_type=None):
-            assert LUX_type is not None, "LUX_type not provided"
-            if LUX_type is Block.L:       # Fill in L
-                magic_s[2*i, 2*j+1] = block[0]
-                magic_s[2*i+1, 2*j] = block[1]
-                magic_s[2*i+1, 2*j+1] = block[2]
-                magic_s[2*i, 2*j] = block[3]
-            if LUX_type is Block.U:       # Fill in U
-                magic_s[2*i, 2*j] = block[0]
-                magic_s[2*i+1, 2*j] = block[1]
-                magic_s[2*i+1, 2*j+1] = block[2]
-                magic_s[2*i, 2*j+1] = block[3]
-            if LUX_type is Block.X:       # Fill in X
-                magic_s[2*i, 2*j] = block[0]
-                magic_s[2*i+1, 2*j+1] = block[1]
-                magic_s[2*i+1, 2*j] = block[2]
-                magic_s[2*i, 2*j+1] = block[3]
-
-        self.magic_s = np.full((n, n), U.EMPTY_CELL, dtype=np.int)
         k = U.get_k(n)
         LUX = make_LUX_square(k)
 
         if self.verbose:
-            print("The LUX square constructed is as follows:\n", LUX, "\n")
+            LUX_string = np.array2string(LUX, formatter={"int": lambda x: Block(x).name})
+            print("The LUX square constructed is as follows:\n", LUX_string, "\n")
+
+        self.magic_s = U.get_output(n, out, self.dtype)
+        if self.pen_and_paper:
+            self._run_walk(self._walk_singly_even(self.magic_s, LUX))
+            return self.magic_s
+
+        # The blocks are visited in the order of the Siamese walk on the
+        # LUX square, so that gives the first number of every block.
+        LUX_size = LUX.shape[0]
+        first = U.fill_siamese_rows(LUX_size, np.empty(LUX.shape, dtype=self.magic_s.dtype))
+        first -= 1
+        first *= 4
+        block_orders = U.LUX_BLOCK_ORDERS.astype(self.magic_s.dtype)
+        # Apart from the swapped middle U and L, every row of the LUX
+        # square has one type of block, so fill in whole rows of blocks
+        # (one corner of each block at a time) with their row's type.
+        row_orders = block_orders[LUX[:, 0]]
+        for di, dj in product(range(2), range(2)):
+            np.add(first, row_orders[:, di, dj, None],
+                   out=self.magic_s[di::2, dj::2])
+        # Then redo the few blocks that differ from the rest of their row.
+        blocks = self.magic_s.reshape(LUX_size, 2, LUX_size, 2).swapaxes(1, 2)
+        swapped = LUX != LUX[:, :1]
+        blocks[swapped] = first[swapped][:, None, None] + block_orders[LUX[swapped]]
+        return self.magic_s
+
+    def _construct_strachey(self, out=None):
+        '''
+        Strachey's method for singly even n = 4k+2, a different square from
+        the LUX one that is quicker for a computer to fill: four copies of
+        the Siamese square of order n/2, plus 0, n*n/4, n*n/2 and 3n*n/4 in
+        the top left, bottom right, top right and bottom left quarters, with
+        a few columns swapped between the left quarters and between the
+        right ones (see U.get_strachey_offsets).
+
+        Reference: https://en.wikipedia.org/wiki/Strachey_method_for_magic_squares
+        '''
+        n = self.n
+        U.assert_divisibility(n, 2)
+        U.assert_indivisibility(n, 4)
+        self.magic_s = U.fill_strachey_rows(n, U.get_output(n, out, self.dtype))
+        return self.magic_s
 
+    def _walk_singly_even(self, magic_s, LUX=None):
+        # The Siamese walk over the LUX square, yielding a step event for every cell filled
+        n = self.n
+        if LUX is None:
+            LUX = make_LUX_square(U.get_k(n))
         LUX_size = LUX.shape[0]
+        # The (row, column) offsets of the 4 cells of each type of block, in
+        # the order they are counted
+        block_cells = [[divmod(int(cell), 2) for cell in np.argsort(orders, axis=None)]
+                       for orders in U.LUX_BLOCK_ORDERS]
+        magic_s.fill(U.EMPTY_CELL)
         # Start from 1
-        current_block = np.arange(4) + 1
+        current_num = 1
         # First cell to fill is the middle one on the top row.
         i, j = 0, (LUX_size-1)//2
-        while current_block[-1] <= n**2:
-            fill_block(self.magic_s, current_block, i, j, LUX[i, j])
-            # magic_s[i, j] = current_num
+        move = Move.Start
+        while current_num <= n**2:
+            block = LUX[i, j]
+            for di, dj in block_cells[block]:
+                magic_s[2*i+di, 2*j+dj] = current_num
+                yield 2*i+di, 2*j+dj, current_num, move, block
+                move = Move.InBlock
+                current_num += 1
             # Move up and right
             new_i, new_j = (i-1) % LUX_size, (j+1) % LUX_size
-            if self.magic_s[2*new_i, 2*new_j] != U.EMPTY_CELL:
+            move = Move.Diagonal
+            if magic_s[2*new_i, 2*new_j] != U.EMPTY_CELL:
                 # If that is already filled, drop down instead.
                 new_i, new_j = i+1, j
+                move = Move.Drop
             i, j = new_i, new_j
-            current_block = current_block + 4         # To fill next block
 
-        return self.magic_s
+    def _run_walk(self, walk):
+        # Fill in the cells by hand, passing each step on to on_step if there is one
+        if self.on_step is None:
+            for _ in walk:
+                pass
+        else:
+            for i, j, value, _, _ in walk:
+                self.on_step(i, j, value)
+
+# The built in methods. The costs were fitted on one machine: only how
+# they compare matters, for choose_method.
+register_method(Method("siamese", [Evenness.Odd], MagicSquare._construct_odd, U.fill_siamese_rows,
+                       setup_seconds=3e-5, row_seconds=1.1e-6, cell_seconds=8.5e-10,
+                       description="Siamese method, filled row by row from its closed form"))
+register_method(Method("siamese_broadcast", [Evenness.Odd], MagicSquare._construct_odd_broadcast,
+                       U.fill_siamese_rows, setup_seconds=1.5e-5, cell_seconds=1.5e-8,
+                       scratch_bytes=24,
+                       description="Siamese method, its closed form over the whole grid at once"))
+register_method(Method("siamese_walk", [Evenness.Odd], MagicSquare._construct_odd, U.fill_siamese_rows,
+                       pen_and_paper=True, cell_seconds=1.1e-6,
+                       description="Siamese method, walked cell by cell"))
+register_method(Method("lux", [Evenness.SinglyEven], MagicSquare._construct_singly_even, U.fill_lux_rows,
+                       setup_seconds=8e-5, row_seconds=3e-7, cell_seconds=3.5e-9, scratch_items=0.375,
+                       description="Conway's LUX method, a whole row of blocks at a time"))
+register_method(Method("lux_walk", [Evenness.SinglyEven], MagicSquare._construct_singly_even,
+                       U.fill_lux_rows, pen_and_paper=True, cell_seconds=1.1e-6,
+                       description="Conway's LUX method, walked block by block"))
+register_method(Method("strachey", [Evenness.SinglyEven], MagicSquare._construct_strachey,
+                       U.fill_strachey_rows, setup_seconds=3e-4, row_seconds=1e-6, cell_seconds=1.8e-9,
+                       description="Strachey's method, four shifted Siamese squares"))
+register_method(Method("doubly_even", [Evenness.DoublyEven], MagicSquare._construct_doubly_even,
+                       U.fill_doubly_even_rows, setup_seconds=2e-5, cell_seconds=1e-9,
+                       description="Doubly even mask, counting forward and backward"))
+register_method(Method("doubly_even_walk", [Evenness.DoublyEven], MagicSquare._construct_doubly_even,
+                       U.fill_doubly_even_rows, pen_and_paper=True, cell_seconds=5.7e-7, scratch_bytes=9,
+                       description="Doubly even mask, counted cell by cell"))
+
+# The product method lives in composition.py, which needs square_cache and
+# so this module: it is only imported once the method is used.
+def _construct_product(ms, out=None):
+    import composition
+    return composition.construct_product(ms, out)
+
+def _fill_product_rows(n, out, row_start=0):
+    import composition
+    return composition.fill_product_rows(n, out, row_start)
+
+def _estimate_factor_seconds(n):
+    # Building the two factor squares, as if they weren't in square_cache yet
+    return sum(get_method(factor).estimate_seconds(factor) for factor in U.get_factor_pair(n))
+
+register_method(Method("product", list(Evenness), _construct_product, _fill_product_rows,
+                       can_build=lambda n: U.get_factor_pair(n) is not None,
+                       setup_seconds=6e-5, cell_seconds=1e-9, extra_seconds=_estimate_factor_seconds,
+                       description="Product of the cached squares of two factors of n"))
@@ -1,33 +1,36 @@
-import numpy as np
-from itertools import product
 import utilities as U
-import curses
-import curses_utilities as CU
-import traceback
 import sys
 
-def construct_odd_magic_square(n, w=None, base_yx=None, delay=500):
+def construct_odd_magic_square(n, on_step=None, pen_and_paper=False,
+                               out=None, dtype=None):
     '''
     This follows the Siamese method, which isn't the best for a computer,
     but is very easy for a human for follow. This function allows comparing
     a human constructed magic square to one a computer generates and verifies.
 
+    By default the cells are computed directly from the closed form of the
+    walk (see U.siamese_values). Set pen_and_paper to fill them in one by
+    one instead; that is always done when an on_step callback is given,
+    which is then called as on_step(i, j, value) for every cell filled
+    (e.g. a curses_utilities.CursesVisualizer).
+    The square goes into out if given, else into a new array of dtype
+    (by default the smallest that fits).
+
     Reference: https://en.wikipedia.org/wiki/Siamese_method
     '''
     U.assert_indivisibility(n, 2)
-    magic_s = np.full((n, n), U.EMPTY_CELL, dtype=int)
-    if w is not None:           # If using curses for displaying updates
-        w.addstr(*base_yx, "{}".format(magic_s))
-        w.refresh()
-        CU.pause_for(delay)
+    magic_s = U.get_output(n, out, dtype)
+    if on_step is None and not pen_and_paper:
+        return U.fill_siamese_rows(n, magic_s)
+    magic_s.fill(U.EMPTY_CELL)
     # Start from 1
     current_num = 1
     # First cell to fill is the middle one on the top row.
     i, j = 0, U.get_k(n)
     while current_num <= n**2:
         magic_s[i, j] = current_num
-        if w is not None:       # If using curses for displaying updates
-            CU.print_cell(w, magic_s, i, j, base_yx=base_yx)
+        if on_step is not None:     # e.g. for displaying updates with curses
+            on_step(i, j, current_num)
         # Move up and right
         new_i, new_j = (i-1)%n, (j+1)%n
         if magic_s[new_i, new_j] != U.EMPTY_CELL:
@@ -38,42 +41,27 @@ def construct_odd_magic_square(n, w=None, base_yx=None, delay=500):
 
     return magic_s
 
-n = 5
-use_curses = False
-if len(sys.argv) > 2 and sys.argv[2]=="use_curses":
-    n, use_curses = int(sys.argv[1]), True
-elif len(sys.argv) > 1:
-    n = int(sys.argv[1])
+def main(argv):
+    n = 5
+    use_curses = False
+    if len(argv) > 2 and argv[2]=="use_curses":
+        n, use_curses = int(argv[1]), True
+    elif len(argv) > 1:
+        n = int(argv[1])
+
+    print("\nFor an {:d} x {:d} magic square, the required sum is: {:d}\n".format(n, n, U.calculate_required_sum(n)))
+    U.set_better_np_printoptions(n)
 
-print("\nFor an {:d} x {:d} magic square, the required sum is: {:d}\n".format(n, n, U.calculate_required_sum(n)))
-U.set_better_np_printoptions(n)
+    if use_curses:
+        import curses_utilities as CU
+        magic_s = CU.visualize(lambda on_step: construct_odd_magic_square(n, on_step=on_step), n)
+        if magic_s is None:
+            return
+    else:
+        magic_s = construct_odd_magic_square(n)
 
-if use_curses:
-    try:
-        w = CU.curses_init()
-        w.addstr("\nFor an {:d} x {:d} magic square, the required sum is: {:d}\n".format(n, n, U.calculate_required_sum(n)))
-        w.refresh()
-        CU.pause_for(500)
-        y, x = w.getyx()
-        magic_s = construct_odd_magic_square(n, w, base_yx=(y+2, 0))
-        y, x = w.getyx()
-        CU.pause_for(1000)
-        w.addstr(y+2, 0, "Press any key to continue...")
-        w.refresh()
-        w.getch()
-        exception = None
-    except:
-        print("Throwing an error now!!")
-        exception = traceback.format_exc()     # print trace back log of the error
-    finally:
-        print("Closing curses...")
-        CU.curses_close(w)
-    if exception is not None:
-        print("Exception occured!")
-        print(exception)
-        print("Continuing after that...")
-else:
-    magic_s = construct_odd_magic_square(n)
+    print(magic_s)
+    U.verify_magic_square(magic_s)
 
-print(magic_s)
-U.verify_magic_square(magic_s)
+if __name__ == "__main__":
+    main(sys.argv)
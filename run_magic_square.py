@@ -12,7 +12,8 @@ for n in [10, 11, 12]:
     # So you can simply call that or have more fine grained control.
     print("\nFor an {:d} x {:d} magic square, the required sum is: {:d}\n".format(n, n, ms.required_sum))
     magic_s = ms.construct()
-    print(magic_s)
+    with U.better_np_printoptions(n):
+        print(magic_s)
     ms.verify()
 
 # You can also test a magic square you hand constructed as follows
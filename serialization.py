@@ -0,0 +1,165 @@
+import os
+import sys
+import numpy as np
+import utilities as U
+
+# Which loader and saver each file extension goes with
+RAW_EXTENSIONS = [".raw", ".bin"]
+TEXT_EXTENSIONS = [".csv", ".txt"]
+
+def save_npy(path, magic_s):
+    np.save(path, magic_s)
+    return path
+
+def load_npy(path, mmap=True):
+    # With mmap, pages of the square are only read in as they are used
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+def save_npz(path, squares, compressed=False):
+    '''
+    Save several squares in one .npz file: squares is a dict of name to
+    square, or a list of squares (then named by their size, as "n_<n>").
+    '''
+    if not isinstance(squares, dict):
+        squares = {"n_{:d}".format(magic_s.shape[0]): magic_s for magic_s in squares}
+    (np.savez_compressed if compressed else np.savez)(path, **squares)
+    return path
+
+def load_npz(path):
+    # A dict of name to square (.npz files can't be memory mapped)
+    with np.load(path) as squares:
+        return {name: squares[name] for name in squares.files}
+
+def save_raw(path, magic_s, dtype=None):
+    '''
+    Just the numbers, row by row, as little-endian integers of dtype (by
+    default that of magic_s), with no header: the size follows from the
+    file size, but the dtype has to be known to load it.
+    '''
+    dtype = np.dtype(magic_s.dtype if dtype is None else dtype).newbyteorder("<")
+    np.asarray(magic_s).astype(dtype, copy=False).tofile(path)
+    return path
+
+def load_raw(path, dtype, mmap=True):
+    dtype = np.dtype(dtype).newbyteorder("<")
+    n = int(np.sqrt(os.path.getsize(path) // dtype.itemsize))
+    assert n*n*dtype.itemsize == os.path.getsize(path), \
+        "{} doesn't hold a square of {}".format(path, dtype.name)
+    if mmap:
+        return np.memmap(path, dtype=dtype, mode="r", shape=(n, n))
+    return np.fromfile(path, dtype=dtype).reshape(n, n)
+
+def get_row_format(n, delimiter=",", aligned=False):
+    # The %-format of one row of text, with the width worked out once for n
+    number_format = "%{:d}d".format(U.get_display_size(n)) if aligned else "%d"
+    return delimiter.join([number_format]*n) + "\n"
+
+def format_rows(rows, row_format):
+    # Some rows of a square as text, all formatted at once
+    return (row_format*len(rows)) % tuple(rows.ravel().tolist())
+
+def save_text(path, magic_s, delimiter=",", aligned=False, max_band_bytes=2**24):
+    '''
+    Write the square as text, one row per line. Each band of rows is
+    formatted with a single %-format over all its numbers, instead of one
+    Python format call per number. With aligned, the numbers are padded to
+    the same width, like the printed square.
+    '''
+    n = magic_s.shape[0]
+    row_format = get_row_format(n, delimiter, aligned)
+    # Text takes up to about 21 characters per number
+    band_rows = U.get_band_rows(n, np.dtype("S21"), max_band_bytes)
+    with open(path, "w") as f:
+        for row_start in range(0, n, band_rows):
+            f.write(format_rows(magic_s[row_start:row_start+band_rows], row_format))
+    return path
+
+def parse_text(text, delimiter=",", dtype=None):
+    '''
+    A square from its text, parsed by NumPy in one go, rows and all (blank
+    lines are skipped, and every other line must hold n numbers). The numbers are kept as int64 unless dtype is
+    given, and then they have to fit in it: the text may come from anywhere,
+    so nothing is ever wrapped around to fit.
+    '''
+    lines = [line for line in text.splitlines() if line.strip()]
+    n = len(lines)
+    # Every row has n numbers, so that ragged text isn't read as a square
+    if delimiter.strip():
+        assert all(line.count(delimiter) == n - 1 for line in lines), "Not every row has {:d} numbers".format(n)
+    else:
+        assert all(len(line.split()) == n for line in lines), "Not every row has {:d} numbers".format(n)
+    values = np.fromstring(delimiter.join(lines), dtype=np.int64, sep=delimiter)
+    assert values.size == n*n, "The text doesn't hold a square"
+    if dtype is None:
+        return values.reshape(n, n)
+    dtype = U.get_dtype(n, dtype)
+    limits = np.iinfo(dtype)
+    assert values.size == 0 or limits.min <= values.min() and values.max() <= limits.max, \
+        "The text has numbers that don't fit in {}".format(dtype)
+    return values.reshape(n, n).astype(dtype, copy=False)
+
+def load_text(path, delimiter=",", dtype=None):
+    with open(path) as f:
+        return parse_text(f.read(), delimiter=delimiter, dtype=dtype)
+
+def get_extension(path):
+    return os.path.splitext(path)[1].lower()
+
+def save(path, magic_s, **kwargs):
+    # Save in the format the extension of path calls for
+    extension = get_extension(path)
+    if extension == ".npy":
+        return save_npy(path, magic_s)
+    if extension == ".npz":
+        return save_npz(path, [magic_s], **kwargs)
+    if extension in RAW_EXTENSIONS:
+        return save_raw(path, magic_s, **kwargs)
+    if extension in TEXT_EXTENSIONS:
+        return save_text(path, magic_s, delimiter="," if extension == ".csv" else " ", **kwargs)
+    raise ValueError("Unknown format for {}".format(path))
+
+def load(path, mmap=True, dtype=None):
+    '''
+    Load a square saved in any of these formats (the first square, for
+    .npz files). Raw files need their dtype.
+    '''
+    extension = get_extension(path)
+    if extension == ".npy":
+        return load_npy(path, mmap=mmap)
+    if extension == ".npz":
+        return next(iter(load_npz(path).values()))
+    if extension in RAW_EXTENSIONS:
+        assert dtype is not None, "Raw files need a dtype to be loaded"
+        return load_raw(path, dtype, mmap=mmap)
+    if extension in TEXT_EXTENSIONS:
+        return load_text(path, delimiter="," if extension == ".csv" else " ", dtype=dtype)
+    raise ValueError("Unknown format for {}".format(path))
+
+def verify_file(path, dtype=None, stop_early=True, check_permutation=False,
+                max_band_bytes=2**26):
+    '''
+    Check the square(s) in a file of any of these formats, straight from
+    the file: .npy files are streamed in bands of rows and raw files are
+    memory mapped, so neither needs to fit in memory. check_permutation
+    needs one byte per number, so like U.verify_magic_square_file it is off
+    unless asked for. Returns a U.VerificationResult, or a dict of them by
+    name for .npz files.
+    '''
+    extension = get_extension(path)
+    if extension == ".npy":
+        return U.verify_magic_square_file(path, max_band_bytes=max_band_bytes, print_message=False,
+                                          stop_early=stop_early, check_permutation=check_permutation)
+    if extension == ".npz":
+        return {name: U.check_magic_square(magic_s, stop_early=stop_early,
+                                           check_permutation=check_permutation)
+                for name, magic_s in load_npz(path).items()}
+    return U.check_magic_square(load(path, mmap=True, dtype=dtype), stop_early=stop_early,
+                                check_permutation=check_permutation)
+
+if __name__ == "__main__":
+    from magic_square import MagicSquare
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    path = sys.argv[2] if len(sys.argv) > 2 else "magic_square_{:d}.csv".format(n)
+    ms = MagicSquare(n)
+    save(path, ms.construct())
+    print("Saved the {:d} x {:d} square to {}: {}".format(n, n, path, verify_file(path, dtype=ms.dtype)))
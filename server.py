@@ -0,0 +1,235 @@
+import io
+import json
+import asyncio
+import hashlib
+import logging
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+import utilities as U
+import serialization as S
+from magic_square import MagicSquare
+
+logger = logging.getLogger("magic_square.server")
+
+# The formats construct can answer in, and their content types
+CONTENT_TYPES = {"csv": "text/csv", "raw": "application/octet-stream",
+                 "npy": "application/octet-stream"}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# The work done in the pool: plain functions, so that a process pool can run them too
+def render_band(n, dtype_name, fmt, row_start, rows):
+    '''
+    Rows row_start to row_start+rows of the n x n square, encoded as fmt:
+    CSV text, or the little-endian numbers (for both raw and npy).
+    '''
+    ms = MagicSquare(n, dtype=dtype_name)
+    band = np.empty((rows, n), dtype=ms.dtype)
+    ms.method.fill_rows(n, band, row_start)
+    if fmt == "csv":
+        return S.format_rows(band, S.get_row_format(n)).encode()
+    return band.astype(band.dtype.newbyteorder("<"), copy=False).tobytes()
+
+def check_body(body, fmt):
+    # Check a square sent as .npy bytes or CSV text, returning a JSON-able dict
+    if fmt == "npy":
+        magic_s = np.load(io.BytesIO(body), allow_pickle=False)
+    else:
+        # Parsed as int64, so no number is wrapped around to fit a smaller dtype
+        magic_s = S.parse_text(body.decode())
+    assert magic_s.ndim == 2 and magic_s.shape[0] == magic_s.shape[1], "The body doesn't hold a square"
+    result = U.check_magic_square(magic_s, stop_early=False)
+    return {"n": result.n, "required_sum": result.required_sum, "is_magic": result.is_magic,
+            "failures": result.failures[:100]}
+
+class MagicSquareServer:
+    '''
+    A small asyncio HTTP/1.1 server, over TCP or a Unix socket, with no
+    dependencies beyond the standard library:
+
+      GET  /construct?n=<n>&format=csv|raw|npy[&dtype=<dtype>]
+      POST /verify?format=npy|csv  (the square as the body)
+      GET  /stats
+
+    The CPU bound work runs in a thread pool (or a process pool), so the
+    event loop keeps serving. A constructed square is streamed back with
+    chunked encoding one band of rows at a time, each band built only when
+    it is about to be sent, so memory stays bounded by max_band_bytes.
+    Identical requests in flight at the same time share their work: the
+    same band, or the same verification, is only computed once.
+
+    A band is at least one row, though, so n is capped at max_n (a row of
+    100000 uint64 numbers is 800KB).
+    '''
+    def __init__(self, workers=None, use_processes=False, max_band_bytes=2**20, max_n=100000):
+        self.executor = (ProcessPoolExecutor if use_processes else ThreadPoolExecutor)(max_workers=workers)
+        self.max_band_bytes = max_band_bytes
+        self.max_n = max_n
+        self.in_flight = {}
+        # The writers whose current response has been started
+        self.responding = set()
+        self.stats = {"requests": 0, "errors": 0, "computed": 0, "coalesced": 0}
+
+    async def run_coalesced(self, key, function, *args):
+        '''
+        Run function(*args) in the pool, unless an identical call (same
+        key) is already running, in which case wait for its result instead.
+        '''
+        future = self.in_flight.get(key)
+        if future is None:
+            self.stats["computed"] += 1
+            future = asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        # Shielded, so that a client going away doesn't cancel the work for the others
+        return await asyncio.shield(future)
+
+    async def handle_construct(self, query, writer):
+        try:
+            n = int(query.get("n", [""])[0])
+        except ValueError:
+            raise HTTPError(400, "n should be an integer")
+        fmt = query.get("format", ["csv"])[0]
+        if fmt not in CONTENT_TYPES:
+            raise HTTPError(400, "format should be one of {}".format(list(CONTENT_TYPES)))
+        if n < 1 or n == 2:
+            raise HTTPError(400, "There is no {:d} x {:d} magic square".format(n, n))
+        if n > self.max_n:
+            raise HTTPError(400, "n should be at most {:d}".format(self.max_n))
+        try:
+            dtype = U.get_dtype(n, query.get("dtype", [None])[0])
+        except (AssertionError, TypeError, ValueError) as error:
+            raise HTTPError(400, "Bad dtype: {}".format(error))
+
+        await self.start_response(writer, 200, CONTENT_TYPES[fmt], chunked=True,
+                                  extra_headers={"X-Magic-Square-N": n, "X-Magic-Square-Dtype": dtype.name})
+        if fmt == "npy":
+            header = io.BytesIO()
+            U.write_npy_header(header, (n, n), dtype.newbyteorder("<"))
+            await self.write_chunk(writer, header.getvalue())
+        band_rows = U.get_band_rows(n, dtype, self.max_band_bytes)
+        for row_start in range(0, n, band_rows):
+            rows = min(band_rows, n - row_start)
+            args = (n, dtype.name, "csv" if fmt == "csv" else "raw", row_start, rows)
+            await self.write_chunk(writer, await self.run_coalesced(("band",) + args, render_band, *args))
+        await self.write_chunk(writer, b"")
+
+    async def handle_verify(self, query, body, writer):
+        fmt = query.get("format", ["npy"])[0]
+        if fmt not in ["npy", "csv"]:
+            raise HTTPError(400, "format should be npy or csv")
+        key = ("verify", fmt, hashlib.sha1(body).hexdigest())
+        try:
+            result = await self.run_coalesced(key, check_body, body, fmt)
+        except (AssertionError, ValueError) as error:
+            raise HTTPError(400, "Could not read the square: {}".format(error))
+        await self.send_json(writer, 200, result)
+
+    async def handle_request(self, method, target, body, writer):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if url.path == "/construct" and method == "GET":
+            await self.handle_construct(query, writer)
+        elif url.path == "/verify" and method == "POST":
+            await self.handle_verify(query, body, writer)
+        elif url.path == "/stats" and method == "GET":
+            await self.send_json(writer, 200, dict(self.stats, in_flight=len(self.in_flight)))
+        else:
+            raise HTTPError(404, "No {} {}".format(method, url.path))
+
+    async def start_response(self, writer, status, content_type, chunked=False,
+                             content_length=None, extra_headers=None):
+        self.responding.add(writer)
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}[status]
+        headers = {"Content-Type": content_type}
+        if chunked:
+            headers["Transfer-Encoding"] = "chunked"
+        else:
+            headers["Content-Length"] = content_length
+        headers.update(extra_headers or {})
+        writer.write("HTTP/1.1 {:d} {}\r\n{}\r\n".format(
+            status, reason, "".join("{}: {}\r\n".format(name, value) for name, value in headers.items())).encode())
+        await writer.drain()
+
+    async def write_chunk(self, writer, data):
+        # An empty chunk ends the response
+        writer.writelines([b"%x\r\n" % len(data), data, b"\r\n"])
+        await writer.drain()
+
+    async def send_json(self, writer, status, content):
+        body = json.dumps(content).encode()
+        await self.start_response(writer, status, "application/json", content_length=len(body))
+        writer.write(body)
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        # Serve requests on one connection until the client closes it
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.stats["requests"] += 1
+                try:
+                    await self.handle_request(method, target, body, writer)
+                except HTTPError as error:
+                    self.stats["errors"] += 1
+                    await self.send_json(writer, error.status, {"error": str(error)})
+                except Exception:
+                    self.stats["errors"] += 1
+                    logger.exception("Error serving %s %s", method, target)
+                    if writer in self.responding:
+                        # The response is half sent, so all we can do is hang up
+                        break
+                    await self.send_json(writer, 500, {"error": "Internal server error"})
+                finally:
+                    self.responding.discard(writer)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.responding.discard(writer)
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8000, unix_path=None):
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=host, port=port)
+        async with server:
+            await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve magic square construction and verification over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix", default=None, help="listen on this Unix socket instead")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-n", type=int, default=100000, help="largest square to construct")
+    parser.add_argument("--processes", action="store_true",
+                        help="use a process pool instead of a thread pool")
+    args = parser.parse_args()
+    logging.basicConfig()
+    server = MagicSquareServer(workers=args.workers, use_processes=args.processes, max_n=args.max_n)
+    print("Serving on {}".format(args.unix or "http://{}:{:d}".format(args.host, args.port)))
+    try:
+        asyncio.run(server.serve(host=args.host, port=args.port, unix_path=args.unix))
+    except KeyboardInterrupt:
+        pass
@@ -1,5 +1,4 @@
 import numpy as np
-from itertools import product
 import utilities as U
 from enum import Enum
 
@@ -25,7 +24,7 @@ def make_LUX_square(k):
     LUX[k+1, k] = Block.L
     return LUX
 
-def fill_block(magic_s, block, i, j, LUX_type=None):
+def fill_block(magic_s, block, i, j, LUX_type=None, on_step=None):
     assert LUX_type is not None, "LUX_type not provided"
     if LUX_type is Block.L:       # Fill in L
         magic_s[2*i, 2*j+1] = block[0]
@@ -42,28 +41,39 @@ def fill_block(magic_s, block, i, j, LUX_type=None):
         magic_s[2*i+1, 2*j+1] = block[1]
         magic_s[2*i+1, 2*j] = block[2]
         magic_s[2*i, 2*j+1] = block[3]
+    if on_step is not None:     # Report the 4 cells in the order they are counted
+        cells = [(2*i+di, 2*j+dj) for di in range(2) for dj in range(2)]
+        for y, x in sorted(cells, key=lambda cell: magic_s[cell]):
+            on_step(y, x, magic_s[y, x])
 
-def construct_singly_even_magic_square(n, print_LUX=True):
+def construct_singly_even_magic_square(n, print_LUX=True, on_step=None,
+                                       out=None, dtype=None):
     '''
     This uses Conway's LUX method, which may not be the best for a computer,
     but is very easy for a human for follow. Hence this allows comparing
     a human constructed magic square to one a computer generates and verifies.
 
+    The square goes into out if given, else into a new array of dtype
+    (by default the smallest that fits). If given, on_step(i, j, value) is
+    called for every cell filled (e.g. a curses_utilities.CursesVisualizer).
+
     Reference: https://en.wikipedia.org/wiki/Conway%27s_LUX_method_for_magic_squares
     '''
     U.assert_divisibility(n, 2)
     U.assert_indivisibility(n, 4)
-    magic_s = np.full((n, n), U.EMPTY_CELL, dtype=np.int)
+    magic_s = U.get_output(n, out, dtype)
+    magic_s.fill(U.EMPTY_CELL)
     k = U.get_k(n)
     LUX = make_LUX_square(k)
-    print("The LUX square constructed is as follows:\n", LUX, "\n")
+    if print_LUX:
+        print("The LUX square constructed is as follows:\n", LUX, "\n")
     LUX_size = LUX.shape[0]
     # Start from 1
     current_block = np.arange(4) + 1
     # First cell to fill is the middle one on the top row.
     i, j = 0, (LUX_size-1)//2
     while current_block[-1] <= n**2:
-        fill_block(magic_s, current_block, i, j, LUX[i, j])
+        fill_block(magic_s, current_block, i, j, LUX[i, j], on_step=on_step)
         # magic_s[i, j] = current_num
         # Move up and right
         new_i, new_j = (i-1) % LUX_size, (j+1) % LUX_size
@@ -75,11 +85,10 @@ def construct_singly_even_magic_square(n, print_LUX=True):
 
     return magic_s
 
-
-
-n = 6
-print("\nFor an {:d} x {:d} magic square, the required sum is: {:d}\n".format(n, n, U.calculate_required_sum(n)))
-magic_s = construct_singly_even_magic_square(n)
-U.set_better_np_printoptions(n)
-print(magic_s)
-U.verify_magic_square(magic_s)
+if __name__ == "__main__":
+    n = 6
+    print("\nFor an {:d} x {:d} magic square, the required sum is: {:d}\n".format(n, n, U.calculate_required_sum(n)))
+    magic_s = construct_singly_even_magic_square(n)
+    U.set_better_np_printoptions(n)
+    print(magic_s)
+    U.verify_magic_square(magic_s)
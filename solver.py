@@ -0,0 +1,286 @@
+import sys
+import time
+import random
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import utilities as U
+from symmetries import dihedral_stack, unique_squares
+
+class MagicSquareSolver:
+    '''
+    Backtracking search over all the normal n x n magic squares, for small n.
+
+    The cells are filled in a fixed order: the first row, then always the
+    cell whose lines are the most complete, so that lines get finished
+    early. When a cell is the last one left on one of its lines its value
+    is forced (the required sum minus the rest of the line), and any other
+    line it finishes must add up too. Otherwise its candidates are the
+    unused numbers (kept as bits of an int) that leave the rest of each of
+    its lines reachable.
+
+    With symmetry_breaking, only one square of each set of 8 rotations and
+    reflections is found: the one whose top left corner is its smallest
+    corner, and whose top right corner is less than its bottom left one.
+    '''
+    def __init__(self, n, symmetry_breaking=True):
+        assert n > 0 and n != 2, "There is no {:d} x {:d} magic square".format(n, n)
+        self.n = n
+        self.n_cells = n*n
+        self.required_sum = U.calculate_required_sum(n)
+        self.symmetry_breaking = symmetry_breaking
+        self.nodes = 0
+        # Lines are the n rows, the n columns, the diagonal and the anti-diagonal
+        self.cell_lines = [[i, n + j] + ([2*n] if i == j else []) + ([2*n + 1] if i + j == n - 1 else [])
+                           for i in range(n) for j in range(n)]
+        self.order = self._get_order()
+        self._set_steps()
+        self.values = [U.EMPTY_CELL]*self.n_cells
+        self.sums = [0]*(2*n + 2)
+
+    def _get_order(self):
+        n = self.n
+        order = list(range(n))
+        filled = [0]*(2*n + 2)
+        for cell in order:
+            for line in self.cell_lines[cell]:
+                filled[line] += 1
+        while len(order) < self.n_cells:
+            cell = max((cell for cell in range(self.n_cells) if cell not in order),
+                       key=lambda cell: (max(filled[line] for line in self.cell_lines[cell]),
+                                         len(self.cell_lines[cell]), -cell))
+            order.append(cell)
+            for line in self.cell_lines[cell]:
+                filled[line] += 1
+        return order
+
+    def _set_steps(self):
+        '''
+        What to do at each position of the order: the line forcing the
+        cell's value (or None), the other lines it finishes, the lines
+        still open with how many cells they lack, and the corners to
+        compare for symmetry breaking once they are all placed.
+        '''
+        n = self.n
+        remaining = [n]*(2*n + 2)
+        corners = [0, n - 1, n*(n - 1), n*n - 1]
+        # (smaller, larger) pairs of corners
+        orderings = [(0, n - 1), (0, n*(n - 1)), (0, n*n - 1), (n - 1, n*(n - 1))]
+        placed = set()
+        self.steps = []
+        for cell in self.order:
+            placed.add(cell)
+            lines = self.cell_lines[cell]
+            for line in lines:
+                remaining[line] -= 1
+            finished = [line for line in lines if remaining[line] == 0]
+            forced_line = finished[0] if finished else None
+            open_lines = [(line, remaining[line]) for line in lines if remaining[line] > 0]
+            comparisons = [(a, b) for a, b in orderings
+                           if cell in (a, b) and a in placed and b in placed] \
+                if self.symmetry_breaking and n > 1 and cell in corners else []
+            self.steps.append((cell, lines, forced_line, finished[1:], open_lines, comparisons))
+
+    def _get_candidates(self, position, free):
+        cell, lines, forced_line, _, open_lines, _ = self.steps[position]
+        N, S = self.n_cells, self.required_sum
+        if forced_line is not None:
+            value = S - self.sums[forced_line]
+            return (1 << value) & free if 1 <= value <= N else 0
+        low, high = 1, N
+        for line, others in open_lines:
+            rest = S - self.sums[line]
+            # The other cells of the line need at least 1+2+..+others
+            # and at most N+(N-1)+..+(N-others+1)
+            low = max(low, rest - (others*N - others*(others - 1)//2))
+            high = min(high, rest - others*(others + 1)//2)
+        if low > high:
+            return 0
+        return free & ((1 << (high + 1)) - (1 << low))
+
+    def _place(self, position, value):
+        # Put value in the cell at position; False if that breaks a line or the symmetry breaking
+        cell, lines, _, finished, _, comparisons = self.steps[position]
+        self.values[cell] = value
+        for line in lines:
+            self.sums[line] += value
+        return (all(self.sums[line] == self.required_sum for line in finished)
+                and all(self.values[a] < self.values[b] for a, b in comparisons))
+
+    def _unplace(self, position, value):
+        cell, lines = self.steps[position][:2]
+        self.values[cell] = U.EMPTY_CELL
+        for line in lines:
+            self.sums[line] -= value
+
+    def _search(self, position, free, stop, found):
+        if position == stop:
+            found.append(list(self.values))
+            return
+        candidates = self._get_candidates(position, free)
+        while candidates:
+            bit = candidates & -candidates
+            candidates ^= bit
+            value = bit.bit_length() - 1
+            self.nodes += 1
+            if self._place(position, value):
+                self._search(position + 1, free ^ bit, stop, found)
+            self._unplace(position, value)
+
+    def _start(self, prefix):
+        # Place the values of prefix (for the first cells of the order); returns the free numbers
+        self.values = [U.EMPTY_CELL]*self.n_cells
+        self.sums = [0]*(2*self.n + 2)
+        free = ((1 << (self.n_cells + 1)) - 1) ^ 1
+        for position, value in enumerate(prefix):
+            assert free >> value & 1 and self._place(position, value), \
+                "{} is not a valid prefix".format(prefix)
+            free ^= 1 << value
+        return free
+
+    def get_prefixes(self, length):
+        '''
+        Every valid way of filling the first length cells of the order (all
+        in the first row while length <= n), to split the search with.
+        '''
+        found = []
+        self._search(0, self._start([]), length, found)
+        return [[values[cell] for cell in self.order[:length]] for values in found]
+
+    def solve(self, prefix=()):
+        # All the squares starting with prefix, as a (count, n, n) array
+        found = []
+        self._search(len(prefix), self._start(prefix), self.n_cells, found)
+        return np.array(found, dtype=U.get_smallest_dtype(self.n)).reshape(-1, self.n, self.n)
+
+    def sample(self, rng=None, max_nodes=10**5):
+        '''
+        A random magic square: the search with the candidates of every cell
+        tried in random order, restarting whenever it runs over max_nodes.
+        '''
+        rng = random.Random() if rng is None else rng
+        while True:
+            self.nodes = 0
+            found = self._random_search(0, self._start([]), rng, max_nodes)
+            if found is not None:
+                return np.array(found, dtype=U.get_smallest_dtype(self.n)).reshape(self.n, self.n)
+
+    def _random_search(self, position, free, rng, max_nodes):
+        if position == self.n_cells:
+            return list(self.values)
+        candidates = self._get_candidates(position, free)
+        values = [value for value in range(1, self.n_cells + 1) if candidates >> value & 1]
+        rng.shuffle(values)
+        for value in values:
+            self.nodes += 1
+            if self.nodes > max_nodes:
+                return None
+            found = None
+            if self._place(position, value):
+                found = self._random_search(position + 1, free ^ (1 << value), rng, max_nodes)
+            self._unplace(position, value)
+            if found is not None or self.nodes > max_nodes:
+                return found
+        return None
+
+# One solver per process, reused by every prefix that process gets
+_solvers = {}
+
+def solve_prefix(n, prefix, symmetry_breaking=True):
+    '''
+    The squares starting with prefix, and the number of nodes searched.
+    Runs inside a worker process.
+    '''
+    key = (n, symmetry_breaking)
+    if key not in _solvers:
+        _solvers[key] = MagicSquareSolver(n, symmetry_breaking=symmetry_breaking)
+    solver = _solvers[key]
+    solver.nodes = 0
+    return solver.solve(prefix), solver.nodes
+
+def enumerate_squares(n, workers=None, prefix_length=2, symmetry_breaking=True,
+                      stats=None):
+    '''
+    Yield every normal n x n magic square, one (count, n, n) array per
+    prefix of the first row as soon as its search is done. The search is
+    split by the first prefix_length numbers of the first row, spread over
+    workers processes (in this process if workers is 0).
+
+    With symmetry_breaking (the default) each square stands for its 8
+    rotations and reflections: 1 for n = 3 and 880 for n = 4 (see
+    all_squares for every one of them). If a dict stats is passed, the
+    nodes searched and the seconds taken are added to it.
+    '''
+    solver = MagicSquareSolver(n, symmetry_breaking=symmetry_breaking)
+    prefix_length = min(prefix_length, n)
+    start = time.perf_counter()
+    nodes = 0
+    prefixes = solver.get_prefixes(prefix_length)
+    nodes += solver.nodes
+    if workers == 0:
+        for prefix in prefixes:
+            squares, prefix_nodes = solve_prefix(n, prefix, symmetry_breaking)
+            nodes += prefix_nodes
+            yield squares
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(solve_prefix, n, prefix, symmetry_breaking)
+                       for prefix in prefixes]
+            for future in as_completed(futures):
+                squares, prefix_nodes = future.result()
+                nodes += prefix_nodes
+                yield squares
+    if stats is not None:
+        stats["nodes"] = stats.get("nodes", 0) + nodes
+        stats["seconds"] = stats.get("seconds", 0.0) + time.perf_counter() - start
+
+def all_squares(n, workers=None):
+    # Every normal n x n magic square: 8 for n = 3, 7040 for n = 4
+    squares = np.concatenate(list(enumerate_squares(n, workers=workers)))
+    if len(squares) == 0:
+        return squares
+    return unique_squares(np.concatenate([dihedral_stack(magic_s) for magic_s in squares]))
+
+def sample_squares(n, count, seed=None, max_nodes=10**5):
+    '''
+    Yield count random n x n magic squares (for n = 5 or 6, say, where
+    there are far too many to enumerate), from randomized searches.
+    '''
+    rng = random.Random(seed)
+    solver = MagicSquareSolver(n, symmetry_breaking=False)
+    for _ in range(count):
+        yield solver.sample(rng, max_nodes=max_nodes)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Enumerate all n x n magic squares (n <= 4) or sample random ones.")
+    parser.add_argument("n", type=int)
+    parser.add_argument("--sample", type=int, default=None,
+                        help="sample this many random squares instead of enumerating")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--prefix-length", type=int, default=2)
+    args = parser.parse_args()
+
+    stats = {}
+    if args.sample is None:
+        squares = enumerate_squares(args.n, workers=args.workers,
+                                    prefix_length=args.prefix_length, stats=stats)
+        squares = (magic_s for chunk in squares for magic_s in chunk)
+    else:
+        start = time.perf_counter()
+        squares = sample_squares(args.n, args.sample, seed=args.seed)
+    count, failed = 0, 0
+    for magic_s in squares:
+        count += 1
+        failed += not U.verify_magic_square(magic_s, print_message=False)
+    if args.sample is None:
+        print("{:d} squares up to rotations and reflections ({:d} in all), {:d} not magic".format(
+            count, 8*count, failed))
+        print("{:d} nodes in {:.2f}s: {:.3g} nodes/s".format(
+            stats["nodes"], stats["seconds"], stats["nodes"]/stats["seconds"]))
+    else:
+        print("{:d} random squares in {:.2f}s, {:d} not magic".format(
+            count, time.perf_counter() - start, failed))
+    if failed:
+        sys.exit(1)
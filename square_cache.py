@@ -0,0 +1,107 @@
+import os
+import threading
+import numpy as np
+import utilities as U
+from collections import OrderedDict
+from magic_square import MagicSquare, get_method
+
+class SquareCache:
+    '''
+    LRU cache of constructed squares keyed by (n, method, dtype), method
+    being any registered in magic_square.METHODS (None for the usual one
+    and "auto" for the cheapest are resolved to theirs first), holding
+    at most max_bytes of squares in memory. Squares are handed out as
+    read-only views, so one cached copy can safely be shared by everyone.
+
+    If cache_dir is set, squares are also kept there as .npy files, a second
+    tier that is checked before constructing and that outlives the process.
+    '''
+    def __init__(self, max_bytes=2**30, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.n_bytes = 0
+        self.hits, self.misses, self.evictions, self.disk_hits = 0, 0, 0, 0
+        self._squares = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, n, method=None, dtype=None):
+        dtype = U.get_dtype(n, dtype)
+        key = (n, get_method(n, method, dtype).name, dtype.name)
+        with self._lock:
+            if key in self._squares:
+                self.hits += 1
+                self._squares.move_to_end(key)
+                return self._squares[key].view()
+            self.misses += 1
+
+        magic_s = self._load(key)
+        if magic_s is None:
+            magic_s = MagicSquare(n, method=key[1], dtype=dtype).construct()
+            self._save(key, magic_s)
+        magic_s.flags.writeable = False
+
+        with self._lock:
+            if key not in self._squares and magic_s.nbytes <= self.max_bytes:
+                self._squares[key] = magic_s
+                self.n_bytes += magic_s.nbytes
+                self._evict(self.max_bytes)
+        return magic_s.view()
+
+    def _evict(self, max_bytes):
+        # Drop least recently used squares until we are within max_bytes
+        while self.n_bytes > max_bytes:
+            _, magic_s = self._squares.popitem(last=False)
+            self.n_bytes -= magic_s.nbytes
+            self.evictions += 1
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, "magic_square_{:d}_{}_{}.npy".format(*key))
+
+    def _load(self, key):
+        if self.cache_dir is None or not os.path.exists(self._get_path(key)):
+            return None
+        self.disk_hits += 1
+        return np.load(self._get_path(key))
+
+    def _save(self, key, magic_s):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write under a temporary name first, so that other processes
+        # sharing cache_dir never load a half written file.
+        path = self._get_path(key)
+        temp_path = "{}.{:d}.tmp".format(path, os.getpid())
+        with open(temp_path, "wb") as f:
+            np.save(f, magic_s)
+        os.replace(temp_path, path)
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict(max_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._squares.clear()
+            self.n_bytes = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "disk_hits": self.disk_hits, "squares": len(self._squares),
+                "bytes": self.n_bytes, "max_bytes": self.max_bytes}
+
+# The module level cache used by get_square
+default_cache = SquareCache()
+
+def configure(max_bytes=None, cache_dir=None):
+    if cache_dir is not None:
+        default_cache.cache_dir = cache_dir
+    if max_bytes is not None:
+        default_cache.resize(max_bytes)
+    return default_cache
+
+def get_square(n, method=None, dtype=None):
+    '''
+    The n x n magic square from the module level cache, as a read-only view.
+    '''
+    return default_cache.get(n, method=method, dtype=dtype)
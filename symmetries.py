@@ -0,0 +1,131 @@
+import numpy as np
+from math import factorial
+from itertools import permutations, islice
+import utilities as U
+
+def dihedral_views(magic_s):
+    '''
+    The 8 rotations and reflections of a square, as strided views of it
+    (nothing is copied): the 4 rotations, then the 4 rotations of its
+    transpose. All of them are magic if magic_s is.
+    '''
+    transposed = magic_s.T
+    return ([np.rot90(magic_s, k) for k in range(4)]
+            + [np.rot90(transposed, k) for k in range(4)])
+
+def dihedral_stack(magic_s, out=None):
+    # The 8 dihedral transforms written into out, a (8, n, n) or bigger stack
+    n = magic_s.shape[0]
+    if out is None:
+        out = np.empty((8, n, n), dtype=magic_s.dtype)
+    for k, view in enumerate(dihedral_views(magic_s)):
+        out[k] = view
+    return out[:8]
+
+def get_dihedral_indices(n):
+    # (8, n*n) flat indices taking a flattened square to its 8 transforms
+    return np.array([view.ravel() for view in dihedral_views(np.arange(n*n).reshape(n, n))])
+
+def centrosymmetric_permutations(n, chunk_size=2**16):
+    '''
+    Yield (up to chunk_size, n) arrays of all the permutations p of range(n)
+    with p[n-1-i] = n-1-p[i]. Applying such a p to both the rows and the
+    columns of a magic square keeps it magic: rows and columns are only
+    reordered, and the cells of both diagonals stay on their diagonals.
+    There are h! 2**h of them for h = n//2 (the pairs of opposite lines can
+    be reordered, and each pair swapped or not).
+    '''
+    h = n//2
+    n_swaps, n_perms = 2**h, factorial(h)*2**h
+    # Number every (pair order, subset of pairs to swap) and cut that range
+    # into chunks, so a chunk can end part way through the swaps of an
+    # order. The orders are read in as the chunks need them.
+    pending = permutations(range(h))
+    order_start, orders = 0, np.zeros((0, h), dtype=np.intp)
+    for start in range(0, n_perms, chunk_size):
+        index = np.arange(start, min(start + chunk_size, n_perms))
+        first, last = index[0] // n_swaps, index[-1] // n_swaps
+        fresh = list(islice(pending, last + 1 - order_start - len(orders)))
+        orders = np.concatenate([orders[first - order_start:],
+                                 np.array(fresh, dtype=np.intp).reshape(len(fresh), h)])
+        order_start = first
+        chosen = orders[index // n_swaps - first]
+        swapped = ((index % n_swaps)[:, None] >> np.arange(h)) & 1
+        top = np.where(swapped.astype(bool), n-1 - chosen, chosen)
+        chunk = np.empty((len(top), n), dtype=np.intp)
+        chunk[:, :h] = top
+        chunk[:, n-h:] = (n-1 - top)[:, ::-1]
+        if n % 2:
+            chunk[:, h] = h         # The middle line stays where it is
+        yield chunk
+
+def variants(magic_s, chunk_size=2**16, out=None):
+    '''
+    Yield stacks of variants of magic_s that are magic as well: its 8
+    dihedral transforms after every centrosymmetric permutation of its rows
+    and columns (see centrosymmetric_permutations), chunk_size at a time.
+    Each chunk is built with a few whole-stack NumPy operations, with no
+    per variant Python work. If out is given (at least (8, n, n)), chunks
+    are written into it and reuse its memory, so use each chunk before
+    asking for the next. The stream can go straight into U.verify_batch.
+
+    Variants can repeat (e.g. the permutation reversing every line is a
+    half turn); see unique_squares and unique_up_to_symmetry.
+    '''
+    n = magic_s.shape[0]
+    if out is None:
+        out = np.empty((max(8, chunk_size), n, n), dtype=magic_s.dtype)
+    assert out.shape[0] >= 8 and out.shape[1:] == (n, n), "out should be a (8 or more, n, n) stack"
+    for perms in centrosymmetric_permutations(n, chunk_size=out.shape[0]//8):
+        stack = out[:8*len(perms)].reshape(len(perms), 8, n, n)
+        stack[:, 0] = magic_s[perms[:, :, None], perms[:, None, :]]
+        stack[:, 4] = stack[:, 0].transpose(0, 2, 1)
+        for k in range(1, 4):
+            stack[:, k] = np.rot90(stack[:, 0], k, axes=(1, 2))
+            stack[:, 4 + k] = np.rot90(stack[:, 4], k, axes=(1, 2))
+        yield out[:8*len(perms)]
+
+def canonical_forms(squares):
+    '''
+    For a (B, n, n) stack, the representative of each square under
+    rotations and reflections: the transform with its smallest corner at
+    the top left, and the smaller of that corner's neighbouring corners at
+    the top right. This is well defined whenever the corners differ, as in
+    every normal magic square, and costs O(n*n) per square.
+    '''
+    B, n = squares.shape[0], squares.shape[1]
+    flat = squares.reshape(B, n*n)
+    transforms = get_dihedral_indices(n)
+    corners = flat[:, transforms[:, [0, n-1, n*(n-1)]]]     # (B, 8, 3)
+    is_canonical = ((corners[:, :, 0] == flat[:, [0, n-1, n*(n-1), n*n-1]].min(1)[:, None])
+                    & (corners[:, :, 1] < corners[:, :, 2]))
+    chosen = transforms[is_canonical.argmax(1)]
+    return np.take_along_axis(flat, chosen, axis=1).reshape(B, n, n)
+
+def unique_squares(squares):
+    # The distinct squares in a (B, n, n) stack, hashing each one's raw bytes
+    B = squares.shape[0]
+    flat = np.ascontiguousarray(squares).reshape(B, -1)
+    keys = flat.view(np.dtype((np.void, flat.dtype.itemsize*flat.shape[1]))).ravel()
+    _, first = np.unique(keys, return_index=True)
+    return squares[np.sort(first)]
+
+def unique_up_to_symmetry(squares):
+    # The distinct squares of a stack, counting rotations and reflections as the same
+    return unique_squares(canonical_forms(squares))
+
+def count_variants(magic_s, chunk_size=2**16):
+    '''
+    Go through all the variants of magic_s, checking each chunk with
+    U.verify_batch, and count them: (total, magic, distinct, distinct up to
+    rotations and reflections).
+    '''
+    total, magic = 0, 0
+    distinct, essentially_distinct = [], []
+    for chunk in variants(magic_s, chunk_size=chunk_size):
+        total += len(chunk)
+        magic += int(U.verify_batch(chunk).sum())
+        distinct.append(unique_squares(chunk))
+        essentially_distinct.append(unique_up_to_symmetry(chunk))
+    return (total, magic, len(unique_squares(np.concatenate(distinct))),
+            len(unique_squares(np.concatenate(essentially_distinct))))
@@ -0,0 +1,65 @@
+import numpy as np
+import utilities as U
+from magic_square import MagicSquare, Move, Block, TRACE_DTYPE, NO_BLOCK
+
+def record_trace(ms, path, chunk_size=2**16):
+    '''
+    Write the step events of building the square of the MagicSquare ms by
+    hand (see MagicSquare.trace) to the .npy file at path, one chunk at a
+    time. There is exactly one event per cell, so the file has n*n of them.
+    '''
+    with open(path, "wb") as f:
+        U.write_npy_header(f, (ms.n**2,), TRACE_DTYPE)
+        for chunk in ms.trace(chunk_size=chunk_size):
+            chunk.tofile(f)
+    return path
+
+def load_trace(path):
+    # The events of a recorded trace, memory mapped rather than read in
+    return np.load(path, mmap_mode="r")
+
+def replay_trace(events, on_step=None, out=None, dtype=None, chunk_size=2**16):
+    '''
+    Fill in a square from recorded step events (an array, or the path of a
+    file written by record_trace), calling on_step(i, j, value) for every
+    step if given, e.g. a curses_utilities.CursesVisualizer. Without
+    on_step each chunk of events is applied in one go.
+    '''
+    if isinstance(events, str):
+        events = load_trace(events)
+    n = int(np.sqrt(len(events)))
+    assert n*n == len(events), "A trace should have n*n events"
+    magic_s = U.get_output(n, out, dtype)
+    magic_s.fill(U.EMPTY_CELL)
+    for start in range(0, len(events), chunk_size):
+        chunk = events[start:start+chunk_size]
+        if on_step is None:
+            magic_s[chunk["i"], chunk["j"]] = chunk["value"]
+            continue
+        for i, j, value in zip(chunk["i"].tolist(), chunk["j"].tolist(), chunk["value"].tolist()):
+            magic_s[i, j] = value
+            on_step(i, j, value)
+    return magic_s
+
+def summarize_trace(events):
+    '''
+    How many steps of each kind of Move, and into each type of LUX Block,
+    a trace (array or path) has: where the walk spends its time.
+    '''
+    if isinstance(events, str):
+        events = load_trace(events)
+    moves = np.bincount(events["move"], minlength=len(Move))
+    blocks = np.bincount(events["block"] - NO_BLOCK, minlength=len(Block) + 1)[1:]
+    return {"steps": len(events),
+            "moves": {move.name: int(moves[move]) for move in Move},
+            "blocks": {block.name: int(blocks[block]) for block in Block}}
+
+if __name__ == "__main__":
+    import sys
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    path = sys.argv[2] if len(sys.argv) > 2 else "trace_{:d}.npy".format(n)
+    record_trace(MagicSquare(n), path)
+    print("Recorded the trace of a {:d} x {:d} square to {}".format(n, n, path))
+    print(summarize_trace(path))
+    magic_s = replay_trace(path)
+    U.verify_magic_square(magic_s)
@@ -1,9 +1,9 @@
 import numpy as np
-from itertools import product
-import curses
-from functools import partial
+import instrumentation as I
 
-EMPTY_CELL = -1
+# Marks a cell not filled in yet. The numbers used are 1 to n*n, so 0 is
+# free and works for unsigned dtypes too.
+EMPTY_CELL = 0
 
 def is_divisible(n, d):
     return n%d == 0
@@ -27,6 +27,486 @@ def get_k(n):
     else:
         return (n-1)//2
 
+def get_factor_pair(n):
+    '''
+    The most balanced p <= q with p*q = n and both at least 3 (there are
+    no 2 x 2 magic squares, and 1 x 1 ones don't help), or None if n has
+    no such factors, e.g. when it is prime.
+    '''
+    for p in range(int(np.sqrt(n)), 2, -1):
+        if n % p == 0 and n//p >= 3:
+            return p, n//p
+    return None
+
+def get_smallest_dtype(n):
+    '''
+    The smallest unsigned integer dtype holding all of 1..n*n: uint8 up to
+    n = 15, uint16 up to n = 255, uint32 up to n = 65535 and uint64 beyond.
+    '''
+    for dtype in [np.uint8, np.uint16, np.uint32, np.uint64]:
+        if n*n <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+
+def get_dtype(n, dtype=None):
+    # dtype if one is given (and it can hold n*n), else the smallest safe one
+    if dtype is None:
+        return get_smallest_dtype(n)
+    dtype = np.dtype(dtype)
+    assert dtype.kind in "iu", "{} is not an integer dtype".format(dtype)
+    assert np.iinfo(dtype).max >= n*n, "{} can't hold numbers up to {:d}".format(dtype, n*n)
+    return dtype
+
+def get_output(n, out=None, dtype=None):
+    '''
+    The array a constructor should write its n x n square into: out if the
+    caller passed one in (to refill it without reallocating), otherwise a
+    new one of get_dtype(n, dtype).
+    '''
+    if out is None:
+        return np.empty((n, n), dtype=get_dtype(n, dtype))
+    assert out.shape == (n, n), "out should have shape ({:d}, {:d})".format(n, n)
+    get_dtype(n, out.dtype)
+    return out
+
+def siamese_values(n, i, j):
+    '''
+    Closed form of the Siamese walk: the number that the walk starting
+    from the middle of the top row writes at (i, j). The walk fills
+    the b-th cell of its a-th diagonal run at (2a-b, k-a+b), so inverting
+    that gives a = i+j-k and b = i+2j-2k (mod n) and the value n*a + b + 1.
+
+    i and j can be ints or any broadcastable index arrays.
+    '''
+    k = get_k(n)
+    return n*((i + j - k) % n) + (i + 2*j - 2*k) % n + 1
+
+def fill_siamese_rows(n, out, row_start=0):
+    '''
+    Fill out (shape (rows, n)) with rows row_start, row_start+1, ... of
+    the Siamese square. Moving down a row shifts the run index a by one
+    column and the position b by h = (n+1)/2 columns (h is 1/2 mod n), so
+    every row is the sum of two windows into doubled copies of the first
+    row's parts. That is one ufunc call per row and no n x n temporaries.
+    '''
+    cols = np.arange(n)
+    runs = np.tile((n*((cols - get_k(n)) % n)).astype(out.dtype), 2)
+    positions = np.tile(((2*cols + 1) % n + 1).astype(out.dtype), 2)
+    h = (n+1)//2
+    for r in range(out.shape[0]):
+        i = row_start + r
+        a, b = i % n, (i*h) % n
+        np.add(runs[a:a+n], positions[b:b+n], out=out[r])
+    return out
+
+# The order (1 to 4) in which the L, U and X blocks of Conway's LUX method
+# fill in their 2x2 cells, indexed by the block type (L=0, U=1, X=2).
+LUX_BLOCK_ORDERS = np.array([[[4, 1], [2, 3]],
+                             [[1, 4], [2, 3]],
+                             [[1, 4], [3, 2]]])
+
+def lux_types(k, I, J):
+    '''
+    Type of block (L=0, U=1, X=2) at (I, J) in the LUX square of size 2k+1:
+    k+1 rows of L, a row of U, k-1 rows of X, with the middle U swapped
+    with the L above it.
+    '''
+    middle = J == k
+    return (I > k)*1 + (I > k+1) + (middle & (I == k)) - (middle & (I == k+1))
+
+def lux_values(n, i, j):
+    '''
+    Closed form of Conway's LUX method: the 2x2 block (i//2, j//2) gets the
+    numbers 4t+1..4t+4, t being the Siamese order of that cell of the LUX
+    square, in the order its block type fills them.
+    '''
+    I, J = i//2, j//2
+    first = 4*(siamese_values(n//2, I, J) - 1)
+    return first + LUX_BLOCK_ORDERS[lux_types(get_k(n), I, J), i % 2, j % 2]
+
+def doubly_even_values(n, i, j):
+    '''
+    Closed form of the doubly even mask method: count forward inside the
+    mask (the corner k x k squares and the middle 2k x 2k one) and
+    backward outside it.
+    '''
+    k = get_k(n)
+    forward = n*i + j + 1
+    in_mask = ((i < k) | (i >= 3*k)) == ((j < k) | (j >= 3*k))
+    return np.where(in_mask, forward, n*n + 1 - forward)
+
+def get_doubly_even_unmasked_regions(n):
+    # The mask is the four k x k corners and the middle 2k x 2k square,
+    # so outside it are the four k x 2k strips between the corners.
+    k = get_k(n)
+    return [(slice(0, k), slice(k, 3*k)),   # top
+            (slice(3*k, n), slice(k, 3*k)), # bottom
+            (slice(k, 3*k), slice(0, k)),   # left
+            (slice(k, 3*k), slice(3*k, n))] # right
+
+def fill_doubly_even_rows(n, out, row_start=0):
+    '''
+    Fill out (shape (rows, n)) with rows row_start, ... of the doubly even
+    square: count forward everywhere, then backward (n*n + 1 minus that)
+    in the parts of the unmasked strips that fall inside these rows.
+    '''
+    rows = np.arange(row_start, row_start + out.shape[0], dtype=out.dtype)
+    np.add((n*rows)[:, None], np.arange(1, n+1, dtype=out.dtype), out=out)
+    for strip_rows, strip_cols in get_doubly_even_unmasked_regions(n):
+        band_rows = slice(max(strip_rows.start - row_start, 0),
+                          max(strip_rows.stop - row_start, 0))
+        np.subtract(n*n + 1, out[band_rows, strip_cols], out=out[band_rows, strip_cols])
+    return out
+
+def fill_lux_rows(n, out, row_start=0):
+    '''
+    Fill out (shape (rows, n)) with rows row_start, ... of the LUX square
+    (Conway's LUX method). Every row of the LUX square has a single block type
+    apart from its middle column, so whole rows are filled with their type
+    (one column of each block at a time) and the middle column is redone.
+    '''
+    m, k = n//2, get_k(n)
+    i = np.arange(row_start, row_start + out.shape[0])
+    I, di = i//2, i % 2
+    first = np.empty((I[-1] - I[0] + 1, m), dtype=out.dtype)
+    fill_siamese_rows(m, first, I[0])
+    first -= 1
+    first *= 4
+    first = first[I - I[0]]         # The block row of each row
+    block_orders = LUX_BLOCK_ORDERS.astype(out.dtype)
+    row_types, middle_types = lux_types(k, I, 0), lux_types(k, I, k)
+    for dj in range(2):
+        np.add(first, block_orders[row_types, di, dj, None], out=out[:, dj::2])
+        out[:, 2*k + dj] = first[:, k] + block_orders[middle_types, di, dj]
+    return out
+
+def get_strachey_offsets(n):
+    '''
+    What Strachey's method adds to the Siamese square of order m = n/2 in
+    each column: A (+0) top left, B (+m*m) bottom right, C (+2m*m) top
+    right and D (+3m*m) bottom left, after swapping the k leftmost columns
+    of A and D (columns 1 to k in the middle row) and the k-1 rightmost
+    of C and B. Indexed by [bottom half, middle row of its half].
+    '''
+    m, k = n//2, get_k(n)
+    q = m*m
+    offsets = np.empty((2, 2, n), dtype=np.int64)
+    offsets[0, :, :m], offsets[0, :, m:] = 0, 2*q
+    offsets[1, :, :m], offsets[1, :, m:] = 3*q, q
+    swapped = offsets.copy()
+    swapped[:, 0, :k] = offsets[::-1, 0, :k]
+    swapped[:, 1, 1:k+1] = offsets[::-1, 1, 1:k+1]
+    swapped[:, :, n-k+1:] = offsets[::-1, :, n-k+1:]
+    return swapped
+
+def fill_strachey_rows(n, out, row_start=0):
+    '''
+    Fill out (shape (rows, n)) with rows row_start, ... of Strachey's square
+    for singly even n: both halves of a row are the same row of the Siamese
+    square of order n/2 plus a row of get_strachey_offsets, which only
+    depends on the half and whether it is its middle row. So every run of
+    rows with the same offsets is filled with one add, and nothing n x n
+    is allocated.
+    '''
+    m, k = n//2, get_k(n)
+    offsets = get_strachey_offsets(n).astype(out.dtype)
+    row_stop = row_start + out.shape[0]
+    # The runs of rows with the same offsets: either side of the middle rows
+    for start in [0, k, k+1, m, m+k, m+k+1]:
+        stop = start + (1 if start % m == k else k)
+        start, stop = max(start, row_start), min(stop, row_stop)
+        if start >= stop:
+            continue
+        rows = out[start-row_start:stop-row_start]
+        # (Filled twice rather than copied, as NumPy would copy through a
+        # temporary for fear of the halves overlapping.)
+        fill_siamese_rows(m, rows[:, :m], start % m)
+        fill_siamese_rows(m, rows[:, m:], start % m)
+        rows += offsets[int(start >= m), int(start % m == k)]
+    return out
+
+def get_band_rows(n, dtype, max_band_bytes):
+    # How many rows of an n x n square of dtype fit in max_band_bytes
+    return max(1, min(n, max_band_bytes // max(1, n*np.dtype(dtype).itemsize)))
+
+def write_npy_header(f, shape, dtype):
+    header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+              "fortran_order": False, "shape": shape}
+    np.lib.format.write_array_header_2_0(f, header)
+
+def read_npy_header(f):
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    assert not fortran_order, "Only C ordered .npy files are supported"
+    return shape, dtype
+
+def read_npy_bands(path, max_band_bytes=2**26):
+    '''
+    Yield (row_start, band) for consecutive bands of rows of the square
+    saved in the .npy file at path, reading only one band at a time.
+    '''
+    with open(path, "rb") as f:
+        (n, n_cols), dtype = read_npy_header(f)
+        assert n == n_cols, "Input is not a square"
+        band_rows = get_band_rows(n, dtype, max_band_bytes)
+        for row_start in range(0, n, band_rows):
+            rows = min(band_rows, n - row_start)
+            band = np.fromfile(f, dtype=dtype, count=rows*n).reshape(rows, n)
+            yield row_start, band
+
+class VerificationResult:
+    '''
+    What check_magic_square found. It is truthy only if the square is magic.
+    failures holds (check, index, total) tuples, check being one of "shape",
+    "range" or "duplicate" (index is then the offending value), "permutation"
+    (index is a missing value), "row", "column" (index is the line, total its
+    sum), "diagonal" or "antidiagonal". With stop_early only the first failure
+    found is kept.
+    '''
+    def __init__(self, n, failures=None):
+        self.n = n
+        self.required_sum = calculate_required_sum(n)
+        self.failures = [] if failures is None else failures
+
+    @property
+    def is_magic(self):
+        return not self.failures
+
+    @property
+    def failure(self):
+        return self.failures[0] if self.failures else None
+
+    def __bool__(self):
+        return self.is_magic
+
+    def __repr__(self):
+        if self.is_magic:
+            return "VerificationResult(n={:d}, magic)".format(self.n)
+        return "VerificationResult(n={:d}, {:d} failures, first: {})".format(
+            self.n, len(self.failures), self.failure)
+
+def get_sum_dtype(dtype):
+    # int64 sums for squares of integers, and float64 for squares of floats
+    # (e.g. from np.loadtxt), exact for whole numbers and not truncating fractions
+    return np.dtype(np.float64 if np.dtype(dtype).kind == "f" else np.int64)
+
+def get_valid_values(values, n):
+    # Which values are whole numbers from 1 to n*n (fractions and NaNs aren't)
+    valid = (values >= 1) & (values <= n*n)
+    if values.dtype.kind == "f":
+        valid &= values == np.floor(values)
+    return valid
+
+def iter_row_blocks(magic_s, max_block_bytes=2**22):
+    # Yield (row_start, block) for bands of rows of an in-memory square
+    n = magic_s.shape[0]
+    block_rows = get_band_rows(n, magic_s.dtype, max_block_bytes)
+    for row_start in range(0, n, block_rows):
+        yield row_start, magic_s[row_start:row_start+block_rows]
+
+def check_row_blocks(blocks, stop_early=True, check_permutation=True):
+    '''
+    The verification engine: a single pass over (row_start, block) bands of
+    rows of a square, checking the rows of each band as it comes in while
+    keeping running column and diagonal sums, and (with check_permutation)
+    which of 1..n*n have been seen so far. Sums are accumulated as int64
+    (float64 for float squares, whose values that aren't whole numbers fail
+    the range check). With stop_early it returns as soon as something is
+    known to be wrong.
+    '''
+    result = None
+
+    def as_number(x):
+        return int(x) if float(x).is_integer() else float(x)
+
+    def fail(check, index, total=None):
+        result.failures.append((check, as_number(index), None if total is None else as_number(total)))
+        return stop_early
+
+    for row_start, block in blocks:
+        rows, n = block.shape
+        if result is None:
+            result = VerificationResult(n)
+            required_sum = result.required_sum
+            sum_dtype = get_sum_dtype(block.dtype)
+            col_sums = np.zeros(n, dtype=sum_dtype)
+            diagonal_1_sum, diagonal_2_sum = 0, 0
+            seen = np.zeros(n*n + 1, dtype=bool) if check_permutation else None
+
+        if check_permutation:
+            values = block.ravel()
+            out_of_range = ~get_valid_values(values, n)
+            if out_of_range.any():
+                if fail("range", values[out_of_range.argmax()]):
+                    return result
+                values = values[~out_of_range]
+            if values.dtype.kind == "f":
+                values = values.astype(np.intp)
+            already_seen = seen[values]
+            if already_seen.any():
+                if fail("duplicate", values[already_seen.argmax()]):
+                    return result
+            # Repeats within this band, which seen can't tell
+            ordered = np.sort(values)
+            repeated = ordered[1:] == ordered[:-1]
+            if repeated.any():
+                if fail("duplicate", ordered[1:][repeated.argmax()]):
+                    return result
+            seen[values] = True
+
+        row_sums = block.sum(1, dtype=sum_dtype)
+        for row in np.flatnonzero(row_sums != required_sum):
+            if fail("row", row_start + row, row_sums[row]):
+                return result
+        col_sums += block.sum(0, dtype=sum_dtype)
+        block_rows = np.arange(rows)
+        diagonal_1_sum += block[block_rows, row_start + block_rows].sum(dtype=sum_dtype)
+        diagonal_2_sum += block[block_rows, n-1 - row_start - block_rows].sum(dtype=sum_dtype)
+
+    if result is None:
+        # No rows at all
+        return VerificationResult(0, [("shape", 0, None)])
+    for col in np.flatnonzero(col_sums != required_sum):
+        if fail("column", col, col_sums[col]):
+            return result
+    if diagonal_1_sum != required_sum and fail("diagonal", 0, diagonal_1_sum):
+        return result
+    if diagonal_2_sum != required_sum and fail("antidiagonal", 0, diagonal_2_sum):
+        return result
+    # A value can only be missing if another was out of range or repeated,
+    # which is reported already, but this says which one.
+    if check_permutation and not seen[1:].all():
+        fail("permutation", np.argmin(seen[1:]) + 1)
+    return result
+
+def check_magic_square(magic_s, stop_early=True, check_permutation=True,
+                       max_block_bytes=2**22):
+    '''
+    Fast, silent counterpart of verify_magic_square. Checks the row, column
+    and diagonal sums in one pass over cache sized bands of rows, and that
+    the square holds each of 1..n*n exactly once. Returns a
+    VerificationResult instead of printing.
+    '''
+    n = magic_s.shape[0]
+    if magic_s.ndim != 2 or n != magic_s.shape[1]:
+        return VerificationResult(n, [("shape", n, None)])
+    with I.phase("check", n):
+        return check_row_blocks(iter_row_blocks(magic_s, max_block_bytes),
+                                stop_early=stop_early, check_permutation=check_permutation)
+
+def verify_magic_square_file(path, max_band_bytes=2**26, print_message=True,
+                             stop_early=True, check_permutation=False):
+    '''
+    Verify the square saved in the .npy file at path one band of rows at
+    a time, so squares that don't fit in memory can be checked as well:
+    memory stays bounded by max_band_bytes. check_permutation also checks
+    that each of 1..n*n is used once, but that keeps one byte per number
+    (about 10GB at n = 100000), so it is off unless asked for.
+    '''
+    with I.phase("verify_file") as timer:
+        result = check_row_blocks(read_npy_bands(path, max_band_bytes),
+                                  stop_early=stop_early, check_permutation=check_permutation)
+        timer.n = result.n
+    if print_message:
+        if result:
+            print("Finished checking {}. All rows, columns and diagonals add up to {:d}.\nSquare is indeed magic!".format(path, result.required_sum))
+        else:
+            print("Finished checking {}. Square is NOT magic: {}".format(path, result.failure))
+    return result
+
+# Per square results of verify_batch(..., detailed=True)
+BATCH_RESULT_DTYPE = np.dtype([("is_magic", bool), ("is_permutation", bool),
+                               ("bad_rows", np.int32), ("bad_columns", np.int32),
+                               ("bad_diagonals", np.int8)])
+
+# The line indicators by n, built once each. They take (n*n)*(2n+2)*8
+# bytes, so past MAX_INDICATOR_N the line sums come from plain reductions.
+LINE_INDICATORS = {}
+MAX_INDICATOR_N = 16
+
+def get_line_indicators(n):
+    '''
+    The (n*n, 2n+2) 0/1 matrix whose columns pick out the n rows, n columns,
+    main diagonal and other diagonal of a flattened n x n square, so that
+    multiplying a (B, n*n) stack of squares by it gives all their line sums.
+    '''
+    if n not in LINE_INDICATORS:
+        lines = np.zeros((n, n, 2*n + 2))
+        for i in range(n):
+            lines[i, :, i] = 1          # row i
+            lines[:, i, n + i] = 1      # column i
+        lines[np.arange(n), np.arange(n), 2*n] = 1
+        lines[np.arange(n), np.arange(n)[::-1], 2*n + 1] = 1
+        lines.flags.writeable = False
+        LINE_INDICATORS[n] = lines.reshape(n*n, 2*n + 2)
+    return LINE_INDICATORS[n]
+
+def get_line_sums(squares):
+    # The (B, 2n+2) row, column, diagonal and other diagonal sums of a (B, n, n) stack
+    B, n = squares.shape[0], squares.shape[1]
+    flat = squares.reshape(B, n*n)
+    limit = 2**52 // max(1, n*n)
+    if n <= MAX_INDICATOR_N and flat.size and -limit <= flat.min() and flat.max() <= limit:
+        # The sums are exact in float64, which lets BLAS do all of them at once
+        return flat.astype(np.float64) @ get_line_indicators(n)
+    sum_dtype = get_sum_dtype(squares.dtype)
+    return np.concatenate([squares.sum(2, dtype=sum_dtype), squares.sum(1, dtype=sum_dtype),
+                           np.trace(squares, axis1=1, axis2=2, dtype=sum_dtype)[:, None],
+                           np.trace(squares[:, :, ::-1], axis1=1, axis2=2, dtype=sum_dtype)[:, None]], axis=1)
+
+def verify_batch_chunk(squares, detailed=False, check_permutation=True):
+    # verify_batch for a single (B, n, n) array
+    B, n = squares.shape[0], squares.shape[1]
+    assert squares.shape == (B, n, n), "Input is not a stack of squares"
+    flat = squares.reshape(B, n*n)
+    sums = get_line_sums(squares)
+    bad_lines = sums != calculate_required_sum(n)
+    if check_permutation:
+        is_permutation = (np.sort(flat, axis=1) == np.arange(1, n*n + 1)).all(1)
+    else:
+        is_permutation = np.ones(B, dtype=bool)
+    is_magic = ~bad_lines.any(1) & is_permutation
+    if not detailed:
+        return is_magic
+    result = np.zeros(B, dtype=BATCH_RESULT_DTYPE)
+    result["is_magic"] = is_magic
+    result["is_permutation"] = is_permutation
+    result["bad_rows"] = bad_lines[:, :n].sum(1)
+    result["bad_columns"] = bad_lines[:, n:2*n].sum(1)
+    result["bad_diagonals"] = bad_lines[:, 2*n:].sum(1)
+    return result
+
+def verify_batch(squares, detailed=False, check_permutation=True,
+                 max_chunk_cells=2**21):
+    '''
+    Verify a whole (B, n, n) stack of squares, or an iterator of such
+    chunks, at once: every row, column and diagonal sum of the batch comes
+    out of a single matrix product (for n up to MAX_INDICATOR_N, or else a
+    few reductions over the whole stack), and (with check_permutation) each
+    square is sorted to check that it holds 1..n*n. Nothing is printed.
+
+    Returns a boolean array with one entry per square, or with detailed a
+    BATCH_RESULT_DTYPE record array counting the faulty lines instead.
+    '''
+    if isinstance(squares, np.ndarray):
+        squares = [squares]
+    results = []
+    with I.phase("verify_batch") as timer:
+        for chunk in squares:
+            chunk = np.asarray(chunk)
+            step = max(1, max_chunk_cells // max(1, chunk[0].size)) if len(chunk) else 1
+            for start in range(0, len(chunk), step):
+                results.append(verify_batch_chunk(chunk[start:start+step], detailed=detailed,
+                                                  check_permutation=check_permutation))
+            if len(chunk):
+                timer.n = chunk.shape[1]
+                I.count("squares_verified", chunk.shape[1], len(chunk))
+    if not results:
+        return np.zeros(0, dtype=BATCH_RESULT_DTYPE if detailed else bool)
+    return np.concatenate(results)
+
 def get_display_size(n):
     return int(np.ceil(np.log10(n**2)))+1
 
@@ -39,72 +519,187 @@ def np_int_formatter(n, x):
     else:
         return get_display_format_string(n).format(x)
 
+def get_np_int_formatter(n):
+    # np_int_formatter for one n, with the width worked out once instead of for every number
+    empty_cell = " "*(get_display_size(n)-1)+"_"
+    format_number = get_display_format_string(n).format
+
+    def formatter(x):
+        return empty_cell if x == EMPTY_CELL else format_number(x)
+    return formatter
+
 def set_better_np_printoptions(n):
-    display_size = get_display_size(n)
-    display_format_string = get_display_format_string(n)
-    formatter = partial(np_int_formatter, n)
-    np.set_printoptions(formatter={"int": formatter})
+    np.set_printoptions(formatter={"int": get_np_int_formatter(n)})
+
+def better_np_printoptions(n):
+    # Like set_better_np_printoptions, but only within a with block
+    return np.printoptions(formatter={"int": get_np_int_formatter(n)})
+
+class DefectReport:
+    '''
+    What verify_magic_square found wrong with a square, kept compact: the
+    (0 based) indices of the rows and columns that don't add up and how
+    far off each is (its sum minus required_sum), the same for the two
+    diagonals (0 if fine), and the values used more than once, not at all,
+    or out of 1..n*n. It is truthy only if the square is magic.
 
-def verify_magic_square(magic_s, print_message=True, print_verbose=False):
+    Nothing is turned into text until asked for, with str() or format(),
+    and then at most max_items of each kind of defect are listed, rows and
+    columns numbered from 1 as in the printed square.
+    '''
+    def __init__(self, n, bad_rows, row_deltas, bad_columns, column_deltas,
+                 diagonal_delta=0, antidiagonal_delta=0, duplicates=None, missing=None,
+                 out_of_range=None):
+        self.n = n
+        self.required_sum = calculate_required_sum(n)
+        self.bad_rows, self.row_deltas = bad_rows, row_deltas
+        self.bad_columns, self.column_deltas = bad_columns, column_deltas
+        self.diagonal_delta, self.antidiagonal_delta = diagonal_delta, antidiagonal_delta
+        empty = np.zeros(0, dtype=np.int64)
+        self.duplicates = empty if duplicates is None else duplicates
+        self.missing = empty if missing is None else missing
+        self.out_of_range = empty if out_of_range is None else out_of_range
+
+    @property
+    def lines_add_up(self):
+        return not (len(self.bad_rows) or len(self.bad_columns) or self.diagonal_delta
+                    or self.antidiagonal_delta)
+
+    @property
+    def is_magic(self):
+        return self.lines_add_up and not (len(self.duplicates) or len(self.missing)
+                                          or len(self.out_of_range))
+
+    def __bool__(self):
+        return self.is_magic
+
+    def __repr__(self):
+        if self.is_magic:
+            return "DefectReport(n={:d}, magic)".format(self.n)
+        return "DefectReport(n={:d}, {:d} bad rows, {:d} bad columns, {:d} bad diagonals, " \
+               "{:d} duplicated, {:d} missing)".format(
+                   self.n, len(self.bad_rows), len(self.bad_columns),
+                   bool(self.diagonal_delta) + bool(self.antidiagonal_delta),
+                   len(self.duplicates), len(self.missing))
+
+    def __str__(self):
+        return self.format()
+
+    def format(self, max_items=10):
+        '''
+        The defects as lines of text, listing at most max_items of each
+        kind (just how many there are, for max_items=0).
+        '''
+        def listed(labels, count):
+            # ": a, b, c and 5 more" for the first max_items labels of count
+            if not max_items:
+                return ""
+            more = count - len(labels)
+            return ": " + ", ".join(labels) + (" and {:d} more".format(more) if more else "")
+
+        def lines_off(indices, deltas):
+            # Numbered from 1, like the rows and columns of the printed square
+            return ["{:d} ({:+})".format(index + 1, delta)
+                    for index, delta in zip(indices[:max_items].tolist(), deltas[:max_items].tolist())]
+
+        lines = []
+        for name, indices, deltas in [("rows", self.bad_rows, self.row_deltas),
+                                      ("columns", self.bad_columns, self.column_deltas)]:
+            if len(indices):
+                lines.append("{:d} {} don't add up to {:d}{}".format(
+                    len(indices), name, self.required_sum, listed(lines_off(indices, deltas), len(indices))))
+        for name, delta in [("The main diagonal", self.diagonal_delta),
+                            ("The other diagonal", self.antidiagonal_delta)]:
+            if delta:
+                lines.append("{} adds up to {} ({:+})".format(name, self.required_sum + delta, delta))
+        for name, values in [("used more than once", self.duplicates), ("missing", self.missing),
+                             ("out of 1 to {:d}".format(self.n**2), self.out_of_range)]:
+            if len(values):
+                lines.append("{:d} values {}{}".format(
+                    len(values), name, listed([str(value) for value in values[:max_items].tolist()], len(values))))
+        return "\n".join(lines) if lines else "No defects, the square is magic"
+
+def find_defects(magic_s, max_block_bytes=2**22):
+    '''
+    Everything wrong with magic_s, as a DefectReport. Sums are taken as
+    int64, so small dtypes can't overflow (float64 for float squares, as in
+    check_row_blocks). Like check_row_blocks it goes
+    through the square a band of rows at a time, and besides the bands it
+    only needs one byte per number, counting how often each of 1..n*n has
+    been seen (up to 2, which is enough to tell duplicates).
+    '''
     n = magic_s.shape[0]
-    assert n==magic_s.shape[1], "Input is not a square"
+    assert magic_s.ndim == 2 and n == magic_s.shape[1], "Input is not a square"
     required_sum = calculate_required_sum(n)
-    print_message = print_message or print_verbose
-    magic_flag = True           # boolean keeping track of magicness
-    if print_message:
-        print("\n"+"-"*40)
-        print("Starting verification:\nSquare size: {:d}x{:d}\nRequired sum: {:d}".format(n, n, required_sum))
-        print("-"*20)
-
-    # columns
-    cols = np.sum(magic_s, 0)
-    # Doesn't add up!
-    if np.any(cols != required_sum):
-        magic_flag = False
-        print("{:d} columns don't add up to required sum".format(np.count_nonzero(cols != required_sum)))
-        if print_verbose:
-            for col in np.argwhere(cols != required_sum).flatten():
-                faulty_column = magic_s[:, col].flatten()
-                print("Column {}: {} adds upto {:d}".format(col+1, faulty_column, np.sum(faulty_column)))
-    elif print_verbose:
-        print("Yes. All columns add up to {:d}".format(required_sum))
-
-    # rows
-    rows = np.sum(magic_s, 1)
-    if np.any(rows != required_sum):
-        magic_flag = False
-        print("{:d} rows don't add up to required sum".format(np.count_nonzero(rows != required_sum)))
-        if print_verbose:
-            for row in np.argwhere(rows != required_sum).flatten():
-                faulty_row = magic_s[row, :].flatten()
-                print("Column {}: {} adds upto {:d}".format(row+1, faulty_row, np.sum(faulty_row)))
-    elif print_verbose:
-        print("Yes. All rows add up to {:d}".format(required_sum))
-
-    # main diagonal (top left to bottom right)
-    diagonal_1_sum = np.trace(magic_s)
-    if diagonal_1_sum != required_sum:
-        magic_flag = False
-        faulty_diagonal = magic_s[np.arange(n), np.arange(n)]
-        print("The main diagonal: {} adds upto {:d}".format(faulty_diagonal, diagonal_1_sum))
-    elif print_verbose:
-        print("Yes. The main diagonal adds up to {:d}".format(required_sum))
-
-    # other diagonal (bottom left to top right)
-    diagonal_2_sum = np.trace(np.rot90(magic_s))
-    if diagonal_2_sum != required_sum:
-        magic_flag = False
-        faulty_diagonal = magic_s[np.arange(n)[::-1], np.arange(n)]
-        print("The other diagonal {} adds upto {:d}".format(faulty_diagonal, diagonal_2_sum))
-    elif print_verbose:
-        print("Yes. The other diagonal also adds up to {:d}".format(required_sum))
+    bad_rows, row_deltas, out_of_range = [], [], []
+    sum_dtype = get_sum_dtype(magic_s.dtype)
+    column_sums = np.zeros(n, dtype=sum_dtype)
+    diagonal_sum, antidiagonal_sum = 0, 0
+    seen = np.zeros(n*n + 1, dtype=np.uint8)
+    for row_start, block in iter_row_blocks(magic_s, max_block_bytes):
+        deltas = np.sum(block, 1, dtype=sum_dtype) - required_sum
+        bad = np.flatnonzero(deltas)
+        bad_rows.append(row_start + bad)
+        row_deltas.append(deltas[bad])
+        column_sums += np.sum(block, 0, dtype=sum_dtype)
+        block_rows = np.arange(block.shape[0])
+        diagonal_sum += np.sum(block[block_rows, row_start + block_rows], dtype=sum_dtype)
+        antidiagonal_sum += np.sum(block[block_rows, n-1 - row_start - block_rows], dtype=sum_dtype)
 
-    # Final printing if all work out
-    if print_message:
-        if magic_flag:
-            print("Finished checking. All rows, columns and diagonals add up to {:d}.\nSquare is indeed magic!".format(required_sum))
-        else:
-            print("Finished checking. Some rows/columns/diagonals do NOT add up to {:d}.\nSquare is NOT magic!".format(required_sum))
-        print("-"*40)
+        values = block.ravel()
+        in_range = get_valid_values(values, n)
+        if not in_range.all():
+            out_of_range.append(np.unique(values[~in_range]))
+            values = values[in_range]
+        if values.dtype.kind == "f":
+            values = values.astype(np.intp)
+        values, counts = np.unique(values, return_counts=True)
+        seen[values] = np.minimum(seen[values] + np.minimum(counts, 2), 2)
+
+    column_deltas = column_sums - required_sum
+    bad_columns = np.flatnonzero(column_deltas)
+    out_of_range = np.unique(np.concatenate(out_of_range)) if out_of_range else None
+    return DefectReport(n, np.concatenate(bad_rows), np.concatenate(row_deltas),
+                        bad_columns, column_deltas[bad_columns],
+                        diagonal_sum - required_sum, antidiagonal_sum - required_sum,
+                        duplicates=np.flatnonzero(seen > 1), missing=np.flatnonzero(seen[1:] == 0) + 1,
+                        out_of_range=out_of_range)
 
-    return magic_flag
+def verify_magic_square(magic_s, print_message=True, print_verbose=False, max_items=10):
+    '''
+    Check magic_s, returning a DefectReport (truthy if it is magic). With
+    print_message a short report is printed as well, listing up to
+    max_items of each kind of defect with print_verbose.
+    '''
+    with I.phase("verify", magic_s.shape[0]):
+        return print_verification(magic_s, print_message=print_message,
+                                  print_verbose=print_verbose, max_items=max_items)
+
+def print_verification(magic_s, print_message=True, print_verbose=False, max_items=10):
+    # The work of verify_magic_square, printing its report if asked to
+    report = find_defects(magic_s)
+    if not (print_message or print_verbose):
+        return report
+    n, required_sum = report.n, report.required_sum
+    print("\n"+"-"*40)
+    print("Starting verification:\nSquare size: {:d}x{:d}\nRequired sum: {:d}".format(n, n, required_sum))
+    print("-"*20)
+    if print_verbose:
+        for name, fine in [("All columns add up", not len(report.bad_columns)),
+                           ("All rows add up", not len(report.bad_rows)),
+                           ("The main diagonal adds up", not report.diagonal_delta),
+                           ("The other diagonal also adds up", not report.antidiagonal_delta)]:
+            if fine:
+                print("Yes. {} to {:d}".format(name, required_sum))
+    if not report:
+        print(report.format(max_items if print_verbose else 0))
+
+    # Final printing if all work out
+    if report:
+        print("Finished checking. All rows, columns and diagonals add up to {:d}.\nSquare is indeed magic!".format(required_sum))
+    elif report.lines_add_up:
+        print("Finished checking. All rows, columns and diagonals add up to {:d},\nbut the numbers are not 1 to {:d} once each.\nSquare is NOT magic!".format(required_sum, n*n))
+    else:
+        print("Finished checking. Some rows/columns/diagonals do NOT add up to {:d}.\nSquare is NOT magic!".format(required_sum))
+    print("-"*40)
+    return report